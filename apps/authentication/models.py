@@ -177,6 +177,12 @@ class User(AbstractUser):
         """Check if this user is blocked another user"""
         return self.blocked_by.filter(blocker=user).exists()
 
+    def touch_chat_rooms(self):
+        """Marks user's chat rooms as changed for inbox delta sync, e.g. after username or photo change"""
+        from apps.chat.models import ChatRoom
+
+        return ChatRoom.touch(Q(creator=self) | Q(subscriber=self))
+
     def toggle_follow(self, user_to_follow):
         """
         Toggle follow/unfollow another user
@@ -207,6 +213,8 @@ class User(AbstractUser):
         Returns tuple: (action_taken, block_relation)
         where action_taken is either 'blocked' or 'unblocked'
         """
+        from apps.chat.services import invalidate_chat_access
+
         if self == user_to_block:
             raise ValueError("You cannot block yourself.")
 
@@ -217,12 +225,14 @@ class User(AbstractUser):
 
         if block_relation:
             block_relation.delete()
+            invalidate_chat_access(self.id, user_to_block.id)
             return 'unblocked', None
         else:
             new_relation = BlockedUser.objects.create(
                 blocker=self,
                 blocked=user_to_block
             )
+            invalidate_chat_access(self.id, user_to_block.id)
             return 'blocked', new_relation
 
     class Meta:
@@ -267,6 +267,7 @@ class AdminBlockCreatorPostAPIView(APIView):
             user.username = None
             user.save(update_fields=['is_blocked_by', 'block_desc', 'block_reason', 'temp_phone_number', 'phone_number',
                                      'temp_username', 'username'])
+            user.touch_chat_rooms()
 
             if report:
                 report.status = ReportStatusTypes.blocked_user
@@ -371,6 +372,7 @@ class AdminUnblockCreatorPostAPIView(APIView):
             user.block_reason = None
             user.save(update_fields=['phone_number', 'temp_phone_number', 'username', 'temp_username', 'is_blocked_by',
                                      'block_desc', 'block_reason'])
+            user.touch_chat_rooms()
 
             response = {
                 'user_id': user.id,
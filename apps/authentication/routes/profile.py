@@ -121,6 +121,7 @@ class DeleteAccountVerifyAPIView(APIView):
         user.is_active = False
         user.is_deleted = True
         user.save()
+        user.touch_chat_rooms()
         return Response({'detail': _('Ваш аккаунт удален')})
 
 
@@ -42,6 +42,12 @@ class BecomeCreatorSerializer(serializers.ModelSerializer):
             return ', '.join(obj.plan_names) if obj.plan_names else None
         return None
 
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if 'username' in validated_data or 'profile_photo' in validated_data:
+            instance.touch_chat_rooms()
+        return instance
+
     class Meta:
         model = User
         fields = [
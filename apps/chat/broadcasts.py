@@ -0,0 +1,152 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from apps.authentication.models import UserSubscription, BlockedUser
+from apps.chat.models import Broadcast, BroadcastStatusEnum, ChatRoom, ChatSettings, Message
+from apps.chat.services import room_group_name, user_group_name
+from apps.files.serializers import FileSerializer
+
+logger = logging.getLogger()
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def get_broadcast_recipients(creator_id):
+    """
+    Ids of active subscribers of the creator that can receive the creator's messages:
+    nobody blocked anybody, and the subscriber either has no chat settings or is open to everyone
+    """
+    blocked = BlockedUser.objects.filter(
+        Q(blocker_id=creator_id, blocked_id=OuterRef('subscriber_id')) |
+        Q(blocker_id=OuterRef('subscriber_id'), blocked_id=creator_id)
+    )
+    chat_settings = ChatSettings.objects.filter(creator_id=OuterRef('subscriber_id'))
+    return list(
+        UserSubscription.objects
+        .filter(creator_id=creator_id, end_date__gt=timezone.now(),
+                subscriber__is_deleted=False, subscriber__is_blocked_by__isnull=True)
+        .exclude(subscriber_id=creator_id)
+        .exclude(Exists(blocked))
+        .exclude(Exists(chat_settings) & ~Exists(chat_settings.filter(can_chat='everyone')))
+        .order_by('subscriber_id')
+        .values_list('subscriber_id', flat=True)
+        .distinct()
+    )
+
+
+def get_broadcast_rooms(creator_id, recipient_ids):
+    """Returns {recipient_id: room_id}, the missing rooms are created with bulk inserts"""
+    rooms = {}
+
+    def load_rooms(user_ids):
+        queryset = ChatRoom.objects.filter(
+            Q(creator_id=creator_id, subscriber_id__in=user_ids) |
+            Q(creator_id__in=user_ids, subscriber_id=creator_id)
+        ).values_list('id', 'creator_id', 'subscriber_id')
+        for room_id, room_creator_id, room_subscriber_id in queryset:
+            rooms[room_subscriber_id if room_creator_id == creator_id else room_creator_id] = room_id
+
+    for user_ids in chunked(recipient_ids, settings.CHAT_BROADCAST['CHUNK_SIZE']):
+        load_rooms(user_ids)
+        missing = [user_id for user_id in user_ids if user_id not in rooms]
+        if missing:
+            ChatRoom.objects.bulk_create(
+                [ChatRoom(creator_id=creator_id, subscriber_id=user_id) for user_id in missing],
+                ignore_conflicts=True,
+            )
+            load_rooms(missing)
+    return rooms
+
+
+async def send_group_events(events, batch_size):
+    channel_layer = get_channel_layer()
+    for batch in chunked(events, batch_size):
+        await asyncio.gather(*(channel_layer.group_send(group, event) for group, event in batch))
+
+
+def deliver_broadcast_chunk(broadcast, recipients):
+    """
+    Inserts one message per (recipient_id, room_id), moves the rooms forward in the inbox
+    and notifies room and personal sockets of the recipients
+    """
+    room_ids = [room_id for _, room_id in recipients]
+    with transaction.atomic():
+        messages = Message.objects.bulk_create([
+            Message(room_id=room_id, sender_id=broadcast.creator_id, content=broadcast.content,
+                    file_id=broadcast.file_id, type=broadcast.type)
+            for room_id in room_ids
+        ])
+        ChatRoom.touch(pk__in=room_ids)
+
+    # in a two member room every unread message sent by the creator is unread for the recipient
+    unread_counts = dict(
+        Message.objects
+        .filter(room_id__in=room_ids, sender_id=broadcast.creator_id, is_read=False)
+        .order_by()
+        .values('room_id')
+        .annotate(count=Count('id'))
+        .values_list('room_id', 'count')
+    )
+
+    file = FileSerializer(broadcast.file).data if broadcast.file else None
+    events = []
+    for (recipient_id, room_id), message in zip(recipients, messages):
+        event = {
+            'message_type': broadcast.type,
+            'type': 'chat_message',
+            'custom_id': None,
+            'message': broadcast.content,
+            'file': file,
+            'sender_id': broadcast.creator_id,
+            'created_at': message.created_at.isoformat(),
+            'message_id': message.id,
+            'room_id': room_id,
+        }
+        events.append((room_group_name(room_id), event))
+        events.append((user_group_name(recipient_id), event))
+        events.append((user_group_name(recipient_id), {
+            'type': 'unread_count',
+            'room_id': room_id,
+            'unread_count': unread_counts.get(room_id, 0),
+        }))
+    # the creator's personal sockets are left out, tens of thousands of echoes would overflow them
+    async_to_sync(send_group_events)(events, settings.CHAT_BROADCAST['EVENT_BATCH_SIZE'])
+
+
+def send_broadcast(broadcast_id):
+    broadcast = Broadcast.objects.select_related('file').get(pk=broadcast_id)
+    is_claimed = Broadcast.objects.filter(
+        pk=broadcast_id, status=BroadcastStatusEnum.pending
+    ).update(status=BroadcastStatusEnum.sending)
+    if not is_claimed:
+        return
+
+    try:
+        recipient_ids = get_broadcast_recipients(broadcast.creator_id)
+        rooms = get_broadcast_rooms(broadcast.creator_id, recipient_ids)
+        recipients = [(user_id, rooms[user_id]) for user_id in recipient_ids if user_id in rooms]
+        Broadcast.objects.filter(pk=broadcast_id).update(recipients_count=len(recipients))
+
+        sent_count = 0
+        for chunk in chunked(recipients, settings.CHAT_BROADCAST['CHUNK_SIZE']):
+            deliver_broadcast_chunk(broadcast, chunk)
+            sent_count += len(chunk)
+            Broadcast.objects.filter(pk=broadcast_id).update(sent_count=sent_count)
+    except Exception as e:
+        logger.exception(f'Broadcast {broadcast_id} failed: {e.args};')
+        Broadcast.objects.filter(pk=broadcast_id).update(status=BroadcastStatusEnum.failed)
+        raise
+
+    Broadcast.objects.filter(pk=broadcast_id).update(status=BroadcastStatusEnum.sent)
+    logger.info(f'Broadcast {broadcast_id} sent: {sent_count} rooms;')
+    return sent_count
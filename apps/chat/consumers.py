@@ -1,82 +1,143 @@
-# consumers.py
+import asyncio
 import base64
-import json
 import logging
 
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django.core.files.base import ContentFile
 
-from apps.chat.models import ChatRoom, Message, BlockedUser
-from apps.chat.services import check_chatting_verification
+from apps.chat.models import ChatRoom, Message
+from apps.chat.presence import TypingThrottle, get_presence, mark_leaving, mark_online
+from apps.chat.protocol import JSONCodec, select_codec
+from apps.chat.services import check_room_access, get_room_members, room_group_name, user_group_name
+from apps.chat.throttling import TokenBucket, consume_user_quota, incr_metric
 from apps.files.serializers import FileSerializer
 from apps.files.utils import upload_file
 
 logger = logging.getLogger()
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.room_id = self.scope['url_route']['kwargs']['room_id']
-        self.user = self.scope['user']
+class ChatEventsMixin:
+    """Message persistence and fan-out shared by room and user sockets"""
+    codec = JSONCodec
 
-        if isinstance(self.user, AnonymousUser):
-            await self.close()
-            return
+    send_queue = None
+    presence_task = None
 
-        # Verify user has access to this chat room
-        chat_access_verification = self.verify_chat_access()
-        if not chat_access_verification:
-            await self.close()
-            return
+    async def accept_with_codec(self):
+        """Accepts the socket, switching to the binary protocol when the client offers its subprotocol"""
+        self.codec = select_codec(self.scope.get('subprotocols'))
+        await self.accept(subprotocol=self.codec.subprotocol)
+        self.start_flow_control()
 
-        self.room_group_name = f'chat_{self.room_id}'
+    def start_flow_control(self):
+        limits = settings.CHAT_FLOW_CONTROL
+        self.rate_bucket = TokenBucket(limits['CONNECTION_RATE'], limits['CONNECTION_BURST'])
+        self.rejected_in_row = 0
+        self.send_queue = asyncio.Queue(maxsize=limits['SEND_QUEUE_SIZE'])
+        self.send_task = asyncio.create_task(self.send_worker())
 
-        # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+    def stop_flow_control(self):
+        if self.send_queue is not None:
+            self.send_task.cancel()
+            self.send_queue = None
 
-        await self.accept()
+    def start_presence(self):
+        self.typing_throttle = TypingThrottle(settings.CHAT_PRESENCE['TYPING_INTERVAL'])
+        self.presence_task = asyncio.create_task(self.presence_worker())
 
-    async def disconnect(self, close_code):
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+    async def stop_presence(self):
+        if self.presence_task is not None:
+            self.presence_task.cancel()
+            self.presence_task = None
+            await mark_leaving(self.user.id)
 
-    @database_sync_to_async
-    def verify_chat_access(self):
-        try:
-            room = ChatRoom.objects.get(pk=self.room_id)
-        except ChatRoom.DoesNotExist:
-            return False
+    async def presence_worker(self):
+        while True:
+            await mark_online(self.user.id)
+            await asyncio.sleep(settings.CHAT_PRESENCE['HEARTBEAT'])
 
-        # Check if current user is part of this chat
-        if self.user not in [room.creator, room.subscriber]:
-            return False
+    async def send_typing(self, room_id):
+        """Typing indicators only travel through the channel layer, callers drop excess ones with typing_throttle"""
+        event = {
+            'type': 'chat_typing',
+            'room_id': room_id,
+            'user_id': self.user.id,
+        }
+        await self.channel_layer.group_send(room_group_name(room_id), event)
+        for member_id in await self.get_room_members(room_id):
+            if member_id != self.user.id:
+                await self.channel_layer.group_send(user_group_name(member_id), event)
+
+    async def chat_typing(self, event):
+        if event['user_id'] != self.user.id:
+            await self.send_event({
+                'type': event['type'],
+                'room_id': event['room_id'],
+                'user_id': event['user_id'],
+            })
+
+    async def send_worker(self):
+        """
+        Writes queued frames to the socket; Daphne accepts a frame as soon as it is in the transport buffer,
+        so the queue only fills when the event loop stalls, clients that stop reading are dropped by config.daphne
+        """
+        while True:
+            frame = await self.send_queue.get()
+            if isinstance(frame, bytes):
+                await self.send(bytes_data=frame)
+            else:
+                await self.send(text_data=frame)
+
+    async def allow_receive(self):
+        """Applies per-connection and per-user rate limits to an incoming frame"""
+        if not self.rate_bucket.consume():
+            metric = 'rate_limited_connection'
+        elif not await consume_user_quota(self.user.id):
+            metric = 'rate_limited_user'
+        else:
+            self.rejected_in_row = 0
+            return True
 
-        # Check if users are blocked
-        if BlockedUser.is_blocked(room.creator, room.subscriber):
-            return False
+        self.rejected_in_row += 1
+        await incr_metric(metric)
+        if self.rejected_in_row >= settings.CHAT_FLOW_CONTROL['MAX_REJECTED_IN_ROW']:
+            await incr_metric('closed_abusive')
+            self.stop_flow_control()
+            await self.close(code=1008)
+        return False
 
-        another_user = room.creator if self.user != room.creator else room.subscriber
-        check_chatting_verification(self.user, another_user)
+    def decode_frame(self, text_data=None, bytes_data=None):
+        return self.codec.decode(bytes_data if bytes_data is not None else text_data)
+
+    async def send_event(self, event):
+        if self.send_queue is None:
+            return
+        try:
+            self.send_queue.put_nowait(self.codec.encode(event))
+        except asyncio.QueueFull:
+            # frames are produced faster than the event loop gets to write them, drop the socket instead of
+            # buffering without a bound
+            await incr_metric('closed_slow_consumer')
+            self.stop_flow_control()
+            await self.close(code=1013)
 
     @database_sync_to_async
-    def create_message(self, content=None, message_type='message', file_data=None, file_name=None):
+    def create_message(self, room_id, content=None, message_type='message', file_data=None, file_name=None):
         try:
-            room = ChatRoom.objects.get(pk=self.room_id)
+            room = ChatRoom.objects.get(pk=room_id)
             message = Message(room=room, sender=self.user, type=message_type)
 
             if content:
                 message.content = content
 
             if file_data or file_name:
-                data = ContentFile(base64.b64decode(file_data), name=file_name)
+                # binary protocol sends raw bytes, JSON protocol a base64 string
+                file_bytes = file_data if isinstance(file_data, bytes) else base64.b64decode(file_data)
+                data = ContentFile(file_bytes, name=file_name)
                 file = upload_file(data)
                 message.file = file
             message.save()
@@ -85,16 +146,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.exception(f"create_message failed: {e.args}")
             raise e
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    @database_sync_to_async
+    def get_room_members(self, room_id):
+        return get_room_members(room_id)
+
+    @database_sync_to_async
+    def get_unread_count(self, room_id, user_id):
+        return Message.objects.filter(room_id=room_id, is_read=False).exclude(sender_id=user_id).count()
+
+    @database_sync_to_async
+    def mark_read(self, room_id, message_id):
+        """Marks every incoming message of the room up to message_id as read"""
+        updated = (
+            Message.objects
+            .filter(room_id=room_id, id__lte=message_id, is_read=False)
+            .exclude(sender=self.user)
+            .update(is_read=True)
+        )
+        if updated:
+            ChatRoom.touch(pk=room_id)
+        return updated
 
+    async def send_to_members(self, room_id, event):
+        for member_id in await self.get_room_members(room_id):
+            await self.channel_layer.group_send(user_group_name(member_id), event)
+
+    async def send_message(self, room_id, text_data_json):
         message_text = text_data_json.get('message')
         message_type = text_data_json.get('type')
         custom_id = text_data_json.get('custom_id')
-        file_data = text_data_json.get('file_data')  # base64 file string
+        file_data = text_data_json.get('file_data')  # base64 file string or raw bytes
         file_name = text_data_json.get('file_name')  # original filename
 
         db_message = await self.create_message(
+            room_id,
             content=message_text,
             message_type=message_type,
             file_data=file_data,
@@ -110,20 +195,133 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'file': file,
             'sender_id': self.user.id,
             'created_at': db_message.created_at.isoformat(),
-            'message_id': db_message.id
+            'message_id': db_message.id,
+            'room_id': room_id,
+        }
+        await self.channel_layer.group_send(room_group_name(room_id), message)
+
+        for member_id in await self.get_room_members(room_id):
+            await self.channel_layer.group_send(user_group_name(member_id), message)
+            if member_id != self.user.id:
+                await self.channel_layer.group_send(user_group_name(member_id), {
+                    'type': 'unread_count',
+                    'room_id': room_id,
+                    'unread_count': await self.get_unread_count(room_id, member_id),
+                })
+
+    async def send_read(self, room_id, message_id):
+        await self.mark_read(room_id, message_id)
+        event = {
+            'type': 'chat_read',
+            'room_id': room_id,
+            'reader_id': self.user.id,
+            'message_id': message_id,
         }
-        await self.channel_layer.group_send(
+        await self.channel_layer.group_send(room_group_name(room_id), event)
+        await self.send_to_members(room_id, event)
+
+    async def chat_read(self, event):
+        await self.send_event({
+            'type': event['type'],
+            'room_id': event['room_id'],
+            'reader_id': event['reader_id'],
+            'message_id': event['message_id'],
+        })
+
+
+class ChatConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    async def connect(self):
+        self.room_id = self.scope['url_route']['kwargs']['room_id']
+        self.user = self.scope['user']
+
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+            return
+
+        # Verify user has access to this chat room
+        chat_access_verification = await self.verify_chat_access()
+        if not chat_access_verification:
+            await self.close()
+            return
+
+        self.room_group_name = room_group_name(self.room_id)
+
+        # Join room group
+        await self.channel_layer.group_add(
             self.room_group_name,
-            message
+            self.channel_name
+        )
+
+        await self.accept_with_codec()
+        self.start_presence()
+        await self.send_room_presence(online=True)
+
+    async def disconnect(self, close_code):
+        self.stop_flow_control()
+        if not hasattr(self, 'room_group_name'):
+            return
+        await self.stop_presence()
+        await self.send_room_presence(online=False)
+        # Leave room group
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
         )
 
+    async def send_room_presence(self, online):
+        """Tells the room that the user opened or left it; a joining user also gets the partner's presence"""
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_presence',
+            'user_id': self.user.id,
+            'online': online,
+        })
+        if online:
+            partner_ids = [member_id for member_id in await self.get_room_members(self.room_id)
+                           if member_id != self.user.id]
+            for presence in await sync_to_async(get_presence)(partner_ids):
+                await self.send_event({'type': 'chat_presence', **presence})
+
+    async def chat_presence(self, event):
+        if event['user_id'] != self.user.id:
+            await self.send_event({
+                'type': event['type'],
+                'user_id': event['user_id'],
+                'online': event['online'],
+            })
+
+    @database_sync_to_async
+    def verify_chat_access(self):
+        return check_room_access(self.room_id, self.user.id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
+        is_typing = text_data_json.get('action') == 'typing'
+        if not await self.allow_receive():
+            if not is_typing:
+                await self.send_event({
+                    'type': 'error',
+                    'code': 'rate_limited',
+                    'custom_id': text_data_json.get('custom_id'),
+                })
+            return
+        if is_typing:
+            if self.typing_throttle.allow(self.room_id):
+                await self.send_typing(self.room_id)
+            return
+        await self.send_message(self.room_id, text_data_json)
+
     async def chat_message(self, event):
         if event['sender_id'] != self.user.id:
-            message = await Message.objects.aget(pk=event['message_id'])
-            message.is_read = True
-            await message.asave()
+            await self.mark_read(self.room_id, event['message_id'])
+            # Keep inbox sockets of the room members in sync with the read watermark
+            await self.send_to_members(self.room_id, {
+                'type': 'chat_read',
+                'room_id': self.room_id,
+                'reader_id': self.user.id,
+                'message_id': event['message_id'],
+            })
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'message': event['message'],
             'type': event['type'],
             'custom_id': event['custom_id'],
@@ -132,4 +330,104 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'created_at': event['created_at'],
             'message_id': event['message_id'],
             'message_type': event['message_type'],
-        }))
+        })
+
+
+class UserChatConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    """
+    One socket per user multiplexing all of the user's rooms;
+    incoming frames are tagged with room_id, action 'read' moves the read watermark
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+            return
+
+        self.user_group_name = user_group_name(self.user.id)
+
+        # Join personal group
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
+
+        await self.accept_with_codec()
+        self.start_presence()
+
+    async def disconnect(self, close_code):
+        self.stop_flow_control()
+        if not hasattr(self, 'user_group_name'):
+            return
+        await self.stop_presence()
+        # Leave personal group
+        await self.channel_layer.group_discard(
+            self.user_group_name,
+            self.channel_name
+        )
+
+    @database_sync_to_async
+    def verify_chat_access(self, room_id):
+        return check_room_access(room_id, self.user.id)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
+        room_id = text_data_json.get('room_id')
+        is_typing = text_data_json.get('action') == 'typing'
+
+        if not await self.allow_receive():
+            if not is_typing:
+                await self.send_event({
+                    'type': 'error',
+                    'code': 'rate_limited',
+                    'room_id': room_id,
+                    'custom_id': text_data_json.get('custom_id'),
+                })
+            return
+
+        if is_typing:
+            # throttled before the access lookup, foreign rooms are ignored silently
+            if (isinstance(room_id, int) and self.typing_throttle.allow(room_id)
+                    and await self.verify_chat_access(room_id)):
+                await self.send_typing(room_id)
+            return
+
+        if not isinstance(room_id, int) or not await self.verify_chat_access(room_id):
+            await self.send_event({
+                'type': 'error',
+                'code': 'forbidden',
+                'room_id': room_id,
+                'custom_id': text_data_json.get('custom_id'),
+            })
+            return
+
+        if text_data_json.get('action') == 'read':
+            message_id = text_data_json.get('message_id')
+            if not isinstance(message_id, int):
+                await self.send_event({'type': 'error', 'code': 'invalid', 'room_id': room_id})
+                return
+            await self.send_read(room_id, message_id)
+        else:
+            await self.send_message(room_id, text_data_json)
+
+    async def chat_message(self, event):
+        await self.send_event({
+            'message': event['message'],
+            'type': event['type'],
+            'custom_id': event['custom_id'],
+            'file': event['file'],
+            'sender_id': event['sender_id'],
+            'created_at': event['created_at'],
+            'message_id': event['message_id'],
+            'message_type': event['message_type'],
+            'room_id': event['room_id'],
+        })
+
+    async def unread_count(self, event):
+        await self.send_event({
+            'type': event['type'],
+            'room_id': event['room_id'],
+            'unread_count': event['unread_count'],
+        })
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import random
+import time
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.authentication.models import User
+from apps.chat.models import ChatRoom
+
+
+class QueryCounter:
+    """Counts queries of every database connection, including ones opened by database_sync_to_async threads"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        for connection in connections.all(initialized_only=True):
+            connection.execute_wrappers.append(self)
+        connection_created.connect(self.on_connection_created, weak=False)
+
+    def on_connection_created(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = ('Drives simulated chat clients through the ASGI application and reports delivery latency, '
+            'throughput and DB queries per message')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100)
+        parser.add_argument('--rooms', type=int, default=100)
+        parser.add_argument('--rate', type=float, default=1.0, help='Messages per second of every client')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of sending')
+        parser.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for late deliveries')
+        parser.add_argument('--prefix', default='chat-bench-')
+        parser.add_argument('--flow-control', action='store_true',
+                            help='Keep CHAT_FLOW_CONTROL limits, by default they are lifted for the run')
+        parser.add_argument('--keep', action='store_true', help='Keep benchmark users, rooms and messages')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 2:
+            raise CommandError('At least 2 clients are required')
+        if not options['flow_control']:
+            settings.CHAT_FLOW_CONTROL = {
+                **settings.CHAT_FLOW_CONTROL,
+                'CONNECTION_RATE': 10 ** 6,
+                'CONNECTION_BURST': 10 ** 6,
+                'USER_MESSAGES_PER_WINDOW': 10 ** 9,
+            }
+
+        users, rooms = self.prepare(options)
+        try:
+            report = asyncio.run(self.run(users, rooms, options))
+        finally:
+            if not options['keep']:
+                User.all_objects.filter(phone_number__startswith=options['prefix']).delete()
+
+        self.stdout.write(f"channel layer      {type(get_channel_layer()).__name__}")
+        self.stdout.write(f"clients / rooms    {len(users)} / {len(rooms)}")
+        self.stdout.write(f"sent / delivered   {report['sent']} / {report['delivered']}")
+        self.stdout.write(f"errors             {report['errors']}")
+        self.stdout.write(f"throughput         {report['delivered'] / report['elapsed']:.1f} msg/s")
+        self.stdout.write(f"latency p50        {percentile(report['latencies'], 50):.2f} ms")
+        self.stdout.write(f"latency p99        {percentile(report['latencies'], 99):.2f} ms")
+        self.stdout.write(f"latency max        {max(report['latencies'], default=0):.2f} ms")
+        self.stdout.write(f"queries / message  {report['queries'] / max(report['sent'], 1):.2f}")
+
+    def prepare(self, options):
+        prefix = options['prefix']
+        User.all_objects.filter(phone_number__startswith=prefix).delete()
+        User.objects.bulk_create([
+            User(phone_number=f'{prefix}{index}', username=f'{prefix}{index}', password='!')
+            for index in range(options['clients'])
+        ])
+        users = list(User.objects.filter(phone_number__startswith=prefix).order_by('id'))
+
+        pairs = {}
+        for index in range(options['rooms']):
+            first = users[index % len(users)]
+            second = users[(index + 1 + index // len(users)) % len(users)]
+            if first.id != second.id:
+                pairs.setdefault(frozenset((first.id, second.id)), (first.id, second.id))
+        ChatRoom.objects.bulk_create(
+            [ChatRoom(creator_id=creator_id, subscriber_id=subscriber_id) for creator_id, subscriber_id in pairs.values()],
+            ignore_conflicts=True,
+        )
+        rooms = list(ChatRoom.objects.filter(creator__in=users).values_list('id', 'creator_id', 'subscriber_id'))
+        return users, rooms
+
+    async def run(self, users, rooms, options):
+        from config.asgi import application
+
+        user_rooms = {user.id: [] for user in users}
+        for room_id, creator_id, subscriber_id in rooms:
+            user_rooms[creator_id].append(room_id)
+            user_rooms[subscriber_id].append(room_id)
+
+        report = {'sent': 0, 'delivered': 0, 'errors': 0, 'latencies': [], 'last_delivered_at': None}
+        clients = []
+        for user in users:
+            communicator = WebsocketCommunicator(application, '/ws/chat/', headers=[
+                (b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode()),
+            ])
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                raise CommandError(f'Client {user.id} could not connect')
+            clients.append((user, communicator))
+
+        counter = QueryCounter()
+        counter.install()
+        stop_sending = asyncio.Event()
+        stop_receiving = asyncio.Event()
+
+        async def send(user, communicator):
+            own_rooms = user_rooms[user.id]
+            if not own_rooms or options['rate'] <= 0:
+                return
+            interval = 1 / options['rate']
+            # spread clients over the first interval, so that they do not send in lockstep
+            await asyncio.sleep(random.random() * interval)
+            while not stop_sending.is_set():
+                await communicator.send_to(text_data=json.dumps({
+                    'room_id': random.choice(own_rooms),
+                    'message': 'benchmark message',
+                    'type': 'message',
+                    'custom_id': str(time.perf_counter_ns()),
+                }))
+                report['sent'] += 1
+                await asyncio.sleep(interval)
+
+        async def receive(user, communicator):
+            while not stop_receiving.is_set():
+                try:
+                    event = json.loads(await communicator.receive_from(timeout=0.5))
+                except asyncio.TimeoutError:
+                    continue
+                if event['type'] == 'error':
+                    report['errors'] += 1
+                elif event['type'] == 'chat_message' and event['sender_id'] != user.id:
+                    report['delivered'] += 1
+                    report['latencies'].append((time.perf_counter_ns() - int(event['custom_id'])) / 1_000_000)
+                    report['last_delivered_at'] = time.perf_counter()
+
+        started = time.perf_counter()
+        receivers = [asyncio.create_task(receive(user, communicator)) for user, communicator in clients]
+        senders = [asyncio.create_task(send(user, communicator)) for user, communicator in clients]
+        await asyncio.sleep(options['duration'])
+        stop_sending.set()
+        await asyncio.gather(*senders)
+        await asyncio.sleep(options['drain'])
+        # throughput is measured up to the last delivery, the idle tail of the drain does not count
+        report['elapsed'] = (report['last_delivered_at'] or time.perf_counter()) - started
+        report['queries'] = counter.count
+        stop_receiving.set()
+        await asyncio.gather(*receivers)
+
+        for _, communicator in clients:
+            await communicator.disconnect()
+        return report
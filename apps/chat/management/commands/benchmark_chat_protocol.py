@@ -0,0 +1,67 @@
+import random
+import string
+import time
+import zlib
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.chat.protocol import JSONCodec, MessagePackCodec
+
+
+def sample_events(count, seed=0):
+    """Chat events shaped like ChatConsumer output: mostly short texts, some file messages"""
+    rnd = random.Random(seed)
+    now = timezone.now()
+    events = []
+    for index in range(count):
+        is_file = rnd.random() < 0.2
+        events.append({
+            'message': None if is_file else ' '.join(
+                ''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(rnd.randint(1, 25))
+            ),
+            'type': 'chat_message',
+            'custom_id': ''.join(rnd.choices(string.hexdigits, k=16)),
+            'file': {
+                'name': 'IMG_%04d.jpg' % index,
+                'size': rnd.randint(10_000, 5_000_000),
+                'path': 'media/uploads/%d%s.jpg' % (time.time_ns(), ''.join(rnd.choices(string.hexdigits, k=32))),
+            } if is_file else None,
+            'sender_id': rnd.randint(1, 100_000),
+            'created_at': (now + timedelta(seconds=index)).isoformat(),
+            'message_id': 1_000_000 + index,
+            'message_type': 'media' if is_file else 'message',
+        })
+    return events
+
+
+class Command(BaseCommand):
+    help = 'Compares bytes on the wire and encode CPU time of JSON and MessagePack chat protocols'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10_000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        events = sample_events(options['events'])
+        self.stdout.write(f"{'codec':<12}{'bytes':>12}{'deflate':>12}{'bytes/evt':>12}{'us/evt':>10}")
+
+        for name, codec in (('json', JSONCodec), ('msgpack', MessagePackCodec)):
+            best = None
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                frames = [codec.encode(event) for event in events]
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+
+            frames = [frame.encode('utf-8') if isinstance(frame, str) else frame for frame in frames]
+            raw_size = sum(len(frame) for frame in frames)
+            # permessage-deflate keeps a sliding window across frames of one connection
+            compressor = zlib.compressobj(wbits=-15)
+            deflate_size = sum(len(compressor.compress(frame) + compressor.flush(zlib.Z_SYNC_FLUSH)) for frame in frames)
+
+            self.stdout.write(
+                f'{name:<12}{raw_size:>12}{deflate_size:>12}'
+                f'{raw_size / len(frames):>12.1f}{best / len(frames) * 1_000_000:>10.2f}'
+            )
@@ -0,0 +1,115 @@
+# Generated by Django 5.2 on 2026-10-19 11:40
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+# chat_message is rebuilt as a table range partitioned by created_at (monthly partitions);
+# primary key of a partitioned table has to include the partition key, so it becomes (id, created_at)
+PARTITION_CHAT_MESSAGE_SQL = [
+    'ALTER TABLE chat_message RENAME TO chat_message_legacy',
+    'UPDATE chat_message_legacy SET created_at = COALESCE(updated_at, now()) WHERE created_at IS NULL',
+    'CREATE SEQUENCE chat_message_partitioned_id_seq',
+    "SELECT setval('chat_message_partitioned_id_seq', COALESCE((SELECT max(id) FROM chat_message_legacy), 0) + 1, false)",
+    """
+    CREATE TABLE chat_message (
+        id bigint NOT NULL DEFAULT nextval('chat_message_partitioned_id_seq'),
+        created_at timestamp with time zone NOT NULL,
+        updated_at timestamp with time zone NULL,
+        content text NULL,
+        is_read boolean NOT NULL,
+        type varchar(55) NULL,
+        file_id bigint NULL REFERENCES file (id) DEFERRABLE INITIALLY DEFERRED,
+        room_id bigint NOT NULL REFERENCES chat_room (id) DEFERRABLE INITIALLY DEFERRED,
+        sender_id bigint NOT NULL REFERENCES "user" (id) DEFERRABLE INITIALLY DEFERRED,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+    """,
+    'ALTER SEQUENCE chat_message_partitioned_id_seq OWNED BY chat_message.id',
+    'CREATE TABLE chat_message_default PARTITION OF chat_message DEFAULT',
+    """
+    DO $$
+    DECLARE
+        month_start date := date_trunc('month', COALESCE((SELECT min(created_at) FROM chat_message_legacy), now()))::date;
+        last_month date := (date_trunc('month', now()) + interval '2 month')::date;
+    BEGIN
+        WHILE month_start <= last_month LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF chat_message FOR VALUES FROM (%L) TO (%L)',
+                'chat_message_p' || to_char(month_start, 'YYYY_MM'),
+                month_start,
+                (month_start + interval '1 month')::date
+            );
+            month_start := (month_start + interval '1 month')::date;
+        END LOOP;
+    END $$
+    """,
+    """
+    INSERT INTO chat_message (id, created_at, updated_at, content, is_read, type, file_id, room_id, sender_id)
+    SELECT id, created_at, updated_at, content, is_read, type, file_id, room_id, sender_id FROM chat_message_legacy
+    """,
+    'DROP TABLE chat_message_legacy',
+    'CREATE INDEX chat_message_file_id_idx ON chat_message (file_id)',
+    'CREATE INDEX chat_message_sender_id_idx ON chat_message (sender_id)',
+    'CREATE INDEX chat_message_room_id_idx ON chat_message (room_id, id)',
+]
+
+# rebuilds a plain chat_message from the partitions still attached; months already archived to MinIO
+# are not restored, their chunks are dropped together with chat_archived_message_chunk
+UNPARTITION_CHAT_MESSAGE_SQL = [
+    'ALTER TABLE chat_message RENAME TO chat_message_partitioned',
+    """
+    CREATE TABLE chat_message (
+        id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+        created_at timestamp with time zone NULL,
+        updated_at timestamp with time zone NULL,
+        content text NULL,
+        is_read boolean NOT NULL,
+        type varchar(55) NULL,
+        file_id bigint NULL REFERENCES file (id) DEFERRABLE INITIALLY DEFERRED,
+        room_id bigint NOT NULL REFERENCES chat_room (id) DEFERRABLE INITIALLY DEFERRED,
+        sender_id bigint NOT NULL REFERENCES "user" (id) DEFERRABLE INITIALLY DEFERRED
+    )
+    """,
+    """
+    INSERT INTO chat_message (id, created_at, updated_at, content, is_read, type, file_id, room_id, sender_id)
+    SELECT id, created_at, updated_at, content, is_read, type, file_id, room_id, sender_id
+    FROM chat_message_partitioned
+    """,
+    "SELECT setval(pg_get_serial_sequence('chat_message', 'id'), COALESCE(max(id), 0) + 1, false) FROM chat_message",
+    # the partitions and the sequence owned by the partitioned table go with it
+    'DROP TABLE chat_message_partitioned',
+    'CREATE INDEX chat_message_file_id_idx ON chat_message (file_id)',
+    'CREATE INDEX chat_message_sender_id_idx ON chat_message (sender_id)',
+    'CREATE INDEX chat_message_room_id_idx ON chat_message (room_id, id)',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_chat_message_room_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_CHAT_MESSAGE_SQL, reverse_sql=UNPARTITION_CHAT_MESSAGE_SQL),
+        migrations.CreateModel(
+            name='ArchivedMessageChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('partition', models.CharField(max_length=63)),
+                ('key', models.TextField()),
+                ('min_id', models.BigIntegerField()),
+                ('max_id', models.BigIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('file_ids', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_chunks', to='chat.chatroom')),
+            ],
+            options={
+                'db_table': 'chat_archived_message_chunk',
+                'indexes': [models.Index(fields=['room', 'max_id'], name='chat_archive_room_max_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_partition_chat_message_archivedmessagechunk'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE SEQUENCE chat_room_sync_seq',
+            reverse_sql='DROP SEQUENCE chat_room_sync_seq',
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='sync_seq',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunSQL(
+            "UPDATE chat_room SET sync_seq = nextval('chat_room_sync_seq')",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 15:58
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import BtreeGinExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_broadcast'),
+    ]
+
+    operations = [
+        BtreeGinExtension(),
+        migrations.AddIndex(
+            model_name='message',
+            index=django.contrib.postgres.indexes.GinIndex(models.F('room'), django.contrib.postgres.search.SearchVector('content', config='simple'), name='chat_message_content_fts_idx'),
+        ),
+    ]
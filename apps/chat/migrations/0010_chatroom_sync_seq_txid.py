@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 17:40
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_message_content_fts_idx'),
+    ]
+
+    operations = [
+        # sequence values are taken before commit and may become visible out of order, rooms are
+        # stamped with transaction ids instead and every existing room is synced again once
+        migrations.RunSQL(
+            'UPDATE chat_room SET sync_seq = txid_current()',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'DROP SEQUENCE chat_room_sync_seq',
+            reverse_sql=[
+                'CREATE SEQUENCE chat_room_sync_seq',
+                "SELECT setval('chat_room_sync_seq', greatest(max(sync_seq), 1)) FROM chat_room",
+            ],
+        ),
+    ]
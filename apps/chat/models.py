@@ -1,10 +1,17 @@
-from django.db import models
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
+from django.db import connection, models
+from django.db.models.expressions import RawSQL
 from django.utils.translation import gettext_lazy as _
 from rest_framework.exceptions import ValidationError
 
 from apps.authentication.models import User, BlockedUser
 from config.models import BaseModel
 
+# chats mix Uzbek, Russian and English, so messages are indexed without language specific stemming
+MESSAGE_SEARCH_CONFIG = 'simple'
+
 
 class CanChatWithSettingsEnum(models.TextChoices):
     everyone = 'everyone', _('Все')
@@ -19,11 +26,20 @@ class MessageTypesEnum(models.TextChoices):
     media = 'media', _('Медиа')
 
 
+class BroadcastStatusEnum(models.TextChoices):
+    pending = 'pending', _('В очереди')
+    sending = 'sending', _('Отправляется')
+    sent = 'sent', _('Отправлено')
+    failed = 'failed', _('Ошибка')
+
+
 class ChatRoom(BaseModel):
     """Represents a chat room between two users"""
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='creator_chat_rooms')
     subscriber = models.ForeignKey(User, on_delete=models.CASCADE, related_name='subscriber_chat_rooms')
     is_active = models.BooleanField(default=True)
+    # id of the last transaction that changed the room in a way visible in the inbox, see sync_watermark
+    sync_seq = models.BigIntegerField(default=0, db_index=True)
 
     class Meta:
         db_table = 'chat_room'
@@ -51,6 +67,21 @@ class ChatRoom(BaseModel):
     def __str__(self):
         return f'Chat between {self.creator} and {self.subscriber}'
 
+    @classmethod
+    def touch(cls, *args, **kwargs):
+        """Moves matching rooms forward in the inbox sync sequence, so that delta sync returns them"""
+        return cls.objects.filter(*args, **kwargs).update(sync_seq=RawSQL('txid_current()', []))
+
+    @staticmethod
+    def sync_watermark() -> int:
+        """
+        Oldest transaction id still in progress; every room touched by an older transaction is committed
+        and visible, rooms touched at or after it may still show up, so delta sync resumes from it inclusively
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+            return cursor.fetchone()[0]
+
 
 class Message(BaseModel):
     """Represents a message in a chat room"""
@@ -62,14 +93,59 @@ class Message(BaseModel):
     type = models.CharField(choices=MessageTypesEnum.choices, default=MessageTypesEnum.message, max_length=55,
                             null=True, blank=True)
 
+    # set on instances restored from the MinIO archive, these are never saved back
+    is_archived = False
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        ChatRoom.touch(pk=self.room_id)
+
     class Meta:
         db_table = 'chat_message'
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+            # room_id inside the GIN index (btree_gin) keeps per-room searches from scanning matches of other rooms
+            GinIndex(models.F('room'), SearchVector('content', config=MESSAGE_SEARCH_CONFIG),
+                     name='chat_message_content_fts_idx'),
+        ]
 
     def __str__(self):
         return f'{self.sender}: {self.content[:10]}...'
 
 
+class ArchivedMessageChunk(BaseModel):
+    """Messages of one room from an archived chat_message partition, stored in MinIO as gzipped JSONL"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archived_chunks')
+    partition = models.CharField(max_length=63)
+    key = models.TextField()
+    min_id = models.BigIntegerField()
+    max_id = models.BigIntegerField()
+    count = models.PositiveIntegerField()
+    file_ids = ArrayField(models.BigIntegerField(), default=list)
+
+    class Meta:
+        db_table = 'chat_archived_message_chunk'
+        indexes = [
+            models.Index(fields=['room', 'max_id'], name='chat_archive_room_max_id_idx'),
+        ]
+
+
+class Broadcast(BaseModel):
+    """Creator's message to all active subscribers, delivered into every subscriber's room by a Celery task"""
+    creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='broadcasts')
+    content = models.TextField(null=True, blank=True)
+    file = models.ForeignKey('files.File', on_delete=models.SET_NULL, null=True, blank=True, related_name='broadcasts')
+    type = models.CharField(choices=MessageTypesEnum.choices, default=MessageTypesEnum.message, max_length=55)
+    status = models.CharField(choices=BroadcastStatusEnum.choices, default=BroadcastStatusEnum.pending, max_length=20)
+    recipients_count = models.PositiveIntegerField(default=0)
+    sent_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'chat_broadcast'
+        ordering = ['-created_at']
+
+
 class ChatSettings(BaseModel):
     """Represents a chat settings of creator"""
 
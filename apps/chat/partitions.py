@@ -0,0 +1,224 @@
+import gzip
+import json
+import logging
+import re
+from datetime import datetime, timezone as dt_timezone
+from itertools import groupby
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.chat.models import Message, ArchivedMessageChunk
+from config.core.minio import s3_client
+
+logger = logging.getLogger()
+
+MESSAGE_TABLE = 'chat_message'
+DEFAULT_PARTITION = 'chat_message_default'
+PARTITION_NAME_RE = re.compile(r'^chat_message_p(\d{4})_(\d{2})$')
+ARCHIVE_COLUMNS = ['id', 'room_id', 'sender_id', 'file_id', 'content', 'is_read', 'type', 'created_at', 'updated_at']
+ARCHIVE_CHUNK_CACHE_TIMEOUT = 60 * 5
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+
+def partition_name(start):
+    return f'{MESSAGE_TABLE}_p{start.year:04d}_{start.month:02d}'
+
+
+def get_message_partitions():
+    """Returns {partition_name: month start} of monthly partitions attached to chat_message"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [MESSAGE_TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            partitions[name] = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+    return partitions
+
+
+def default_partition_months():
+    """Month starts of rows that landed in the default partition because their partition was missing"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION}"
+        )
+        return [row[0].replace(tzinfo=dt_timezone.utc) for row in cursor.fetchall()]
+
+
+def create_message_partition(start):
+    """
+    Creates the partition of the month; rows of that month already in the default partition would make
+    CREATE TABLE ... PARTITION OF fail, so the default is detached while they are moved into the new partition
+    """
+    end = add_months(start, 1)
+    name = partition_name(start)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s)',
+            [start, end]
+        )
+        if not cursor.fetchone()[0]:
+            cursor.execute(f'CREATE TABLE {name} PARTITION OF {MESSAGE_TABLE} FOR VALUES FROM (%s) TO (%s)',
+                           [start, end])
+            return 0
+
+        columns = ', '.join(ARCHIVE_COLUMNS)
+        cursor.execute(f'ALTER TABLE {MESSAGE_TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(f'CREATE TABLE {name} PARTITION OF {MESSAGE_TABLE} FOR VALUES FROM (%s) TO (%s)',
+                       [start, end])
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s '
+            f'RETURNING {columns}) INSERT INTO {MESSAGE_TABLE} ({columns}) SELECT {columns} FROM moved',
+            [start, end]
+        )
+        moved = cursor.rowcount
+        cursor.execute(f'ALTER TABLE {MESSAGE_TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    logger.warning(f'Message partition {name} created late, {moved} messages moved out of {DEFAULT_PARTITION};')
+    return moved
+
+
+def ensure_message_partitions(months_ahead=None):
+    """
+    Creates monthly partitions from the current month up to months_ahead months forward, and for every
+    month that has rows in the default partition; a failing month is logged and the others still created
+    """
+    if months_ahead is None:
+        months_ahead = settings.CHAT_MESSAGE_PARTITION_MONTHS_AHEAD
+    current_month = month_start(timezone.now())
+    months = {add_months(current_month, offset) for offset in range(months_ahead + 1)}
+    months.update(default_partition_months())
+
+    existing = set(get_message_partitions())
+    failed = []
+    for start in sorted(months):
+        if partition_name(start) in existing:
+            continue
+        try:
+            create_message_partition(start)
+        except Exception as e:
+            failed.append(partition_name(start))
+            logger.exception(f'Message partition {partition_name(start)} was not created: {e.args};')
+    return failed
+
+
+def archive_key(partition, room_id):
+    return f'{settings.CHAT_MESSAGE_ARCHIVE_PREFIX}/{partition}/{room_id}.jsonl.gz'
+
+
+def dump_rows(rows):
+    lines = []
+    for row in rows:
+        row = dict(zip(ARCHIVE_COLUMNS, row))
+        row['created_at'] = row['created_at'].isoformat()
+        row['updated_at'] = row['updated_at'].isoformat() if row['updated_at'] else None
+        lines.append(json.dumps(row, ensure_ascii=False))
+    return gzip.compress('\n'.join(lines).encode('utf-8'))
+
+
+def archive_message_partition(partition):
+    """
+    Uploads messages of the partition to MinIO as one gzipped JSONL object per room,
+    records the chunks and drops the partition
+    """
+    chunks = []
+    # server side cursor, so that the partition is streamed instead of loaded at once
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM {partition} ORDER BY room_id, id')
+        for room_id, rows in groupby(cursor, key=lambda row: row[1]):
+            rows = list(rows)
+            key = archive_key(partition, room_id)
+            s3_client.put_object(
+                Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                Key=key,
+                Body=dump_rows(rows),
+                ContentType='application/x-ndjson',
+                ContentEncoding='gzip',
+            )
+            chunks.append(ArchivedMessageChunk(
+                room_id=room_id,
+                partition=partition,
+                key=key,
+                min_id=rows[0][0],
+                max_id=rows[-1][0],
+                count=len(rows),
+                file_ids=sorted({row[3] for row in rows if row[3]}),
+            ))
+
+    with transaction.atomic():
+        ArchivedMessageChunk.objects.filter(partition=partition).delete()
+        ArchivedMessageChunk.objects.bulk_create(chunks, batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {MESSAGE_TABLE} DETACH PARTITION {partition}')
+            cursor.execute(f'DROP TABLE {partition}')
+    logger.info(f'Message partition {partition} archived: {len(chunks)} rooms;')
+    return len(chunks)
+
+
+def archive_old_message_partitions(after_months=None):
+    if after_months is None:
+        after_months = settings.CHAT_MESSAGE_ARCHIVE_AFTER_MONTHS
+    cutoff = add_months(month_start(timezone.now()), -after_months)
+
+    archived = []
+    for partition, start in sorted(get_message_partitions().items(), key=lambda item: item[1]):
+        if add_months(start, 1) <= cutoff:
+            archive_message_partition(partition)
+            archived.append(partition)
+    return archived
+
+
+def read_archive_chunk(chunk):
+    cache_key = f'chat_archive_chunk:{chunk.key}'
+    rows = cache.get(cache_key)
+    if rows is None:
+        obj = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=chunk.key)
+        rows = [json.loads(line) for line in gzip.decompress(obj['Body'].read()).decode('utf-8').splitlines()]
+        cache.set(cache_key, rows, ARCHIVE_CHUNK_CACHE_TIMEOUT)
+    return rows
+
+
+def load_archived_messages(room_id, before_id, limit):
+    """
+    Returns (messages, has_more) with up to `limit` archived messages of the room older than before_id,
+    newest first; messages are unsaved instances marked with `is_archived`
+    """
+    chunks = ArchivedMessageChunk.objects.filter(room_id=room_id).order_by('-max_id')
+    if before_id is not None:
+        chunks = chunks.filter(min_id__lt=before_id)
+
+    messages = []
+    for chunk in chunks:
+        if len(messages) > limit:
+            break
+        for row in reversed(read_archive_chunk(chunk)):
+            if before_id is None or row['id'] < before_id:
+                message = Message(**{
+                    **row,
+                    'created_at': parse_datetime(row['created_at']),
+                    'updated_at': parse_datetime(row['updated_at']) if row['updated_at'] else None,
+                })
+                message.is_archived = True
+                messages.append(message)
+
+    messages, has_more = messages[:limit], len(messages) > limit
+    prefetch_related_objects(messages, 'sender', 'file')
+    return messages, has_more
@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def presence_key(user_id):
+    return f'chat_presence:{user_id}'
+
+
+def last_seen_key(user_id):
+    return f'chat_last_seen:{user_id}'
+
+
+async def mark_online(user_id):
+    """Heartbeat of an open socket; the presence key outlives a few missed heartbeats only"""
+    now = int(time.time())
+    await cache.aset(presence_key(user_id), now, timeout=settings.CHAT_PRESENCE['TTL'])
+    await cache.aset(last_seen_key(user_id), now, timeout=settings.CHAT_PRESENCE['LAST_SEEN_TTL'])
+
+
+async def mark_leaving(user_id):
+    """
+    Shortens the presence key down to one heartbeat interval instead of deleting it:
+    another open socket of the user refreshes it in time, otherwise the user goes offline
+    """
+    await cache.atouch(presence_key(user_id), settings.CHAT_PRESENCE['HEARTBEAT'] + 5)
+    await cache.aset(last_seen_key(user_id), int(time.time()), timeout=settings.CHAT_PRESENCE['LAST_SEEN_TTL'])
+
+
+def get_presence(user_ids):
+    keys = [presence_key(user_id) for user_id in user_ids] + [last_seen_key(user_id) for user_id in user_ids]
+    values = cache.get_many(keys)
+    return [
+        {
+            'user_id': user_id,
+            'online': presence_key(user_id) in values,
+            'last_seen': values.get(last_seen_key(user_id)),
+        }
+        for user_id in user_ids
+    ]
+
+
+class TypingThrottle:
+    """Lets through at most one typing event per room every TYPING_INTERVAL seconds for a connection"""
+    max_rooms = 100
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.sent_at = {}
+
+    def allow(self, room_id):
+        now = time.monotonic()
+        if now - self.sent_at.get(room_id, -self.interval) < self.interval:
+            return False
+        if len(self.sent_at) >= self.max_rooms:
+            # room ids come from the client, expired entries are forgotten instead of kept for the connection life
+            self.sent_at = {key: sent_at for key, sent_at in self.sent_at.items() if now - sent_at < self.interval}
+        self.sent_at[room_id] = now
+        return True
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime
+
+import msgpack
+
+MSGPACK_SUBPROTOCOL = 'sapi.msgpack.v1'
+
+# Short field codes of the binary protocol, integer map keys take a single byte in MessagePack
+FIELD_CODES = {
+    'type': 0,
+    'message_type': 1,
+    'message': 2,
+    'custom_id': 3,
+    'file': 4,
+    'sender_id': 5,
+    'created_at': 6,
+    'message_id': 7,
+    'room_id': 8,
+    'reader_id': 9,
+    'unread_count': 10,
+    'code': 11,
+    'action': 12,
+    'file_data': 13,
+    'file_name': 14,
+    'user_id': 15,
+    'online': 16,
+    'last_seen': 17,
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+class JSONCodec:
+    subprotocol = None
+
+    @staticmethod
+    def encode(event: dict) -> str:
+        return json.dumps(event)
+
+    @staticmethod
+    def decode(frame) -> dict:
+        return json.loads(frame)
+
+
+class MessagePackCodec:
+    """
+    Binary frames with short integer field codes;
+    created_at travels as unix epoch milliseconds, file_data as raw bytes instead of base64
+    """
+    subprotocol = MSGPACK_SUBPROTOCOL
+
+    @staticmethod
+    def encode(event: dict) -> bytes:
+        data = {}
+        for key, value in event.items():
+            if key == 'created_at' and isinstance(value, str):
+                value = int(datetime.fromisoformat(value).timestamp() * 1000)
+            data[FIELD_CODES.get(key, key)] = value
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def decode(frame: bytes) -> dict:
+        data = msgpack.unpackb(frame, raw=False, strict_map_key=False)
+        return {FIELD_NAMES.get(key, key): value for key, value in data.items()}
+
+
+def select_codec(subprotocols):
+    """Picks the codec of the first subprotocol offered by the client that the server supports"""
+    if MSGPACK_SUBPROTOCOL in (subprotocols or []):
+        return MessagePackCodec
+    return JSONCodec
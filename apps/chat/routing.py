@@ -1,8 +1,9 @@
 from django.urls import re_path, path
 
-from apps.chat.consumers import ChatConsumer
+from apps.chat.consumers import ChatConsumer, UserChatConsumer
 
 websocket_urlpatterns = [
     # re_path(r'ws/chat/(?P<room_id>\w+)/$', ChatConsumer.as_asgi()),
+    path('ws/chat/', UserChatConsumer.as_asgi()),
     path('ws/chat/<int:room_id>/', ChatConsumer.as_asgi()),
 ]
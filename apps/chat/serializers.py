@@ -1,8 +1,14 @@
-from rest_framework import serializers
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers, status
 
 from apps.authentication.models import SubscriptionPlan, BlockedUser
-from apps.chat.models import Message, ChatRoom, ChatSettings
+from apps.chat.models import Message, ChatRoom, ChatSettings, Broadcast
+from apps.files.models import File
+from apps.files.orphans import orphaned_files
 from apps.files.serializers import FileSerializer
+from config.core.api_exceptions import APIValidation
 
 
 class UserChatRoomListSerializer(serializers.ModelSerializer):
@@ -74,6 +80,23 @@ class UserChatRoomListSerializer(serializers.ModelSerializer):
         ]
 
 
+class MessageReadListSerializer(serializers.ListSerializer):
+    """Marks incoming messages of the page as read with a single update and touches their rooms once"""
+
+    def to_representation(self, data):
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        user = self.context['request'].user
+        unread = [message for message in messages
+                  if message.sender_id != user.id and not message.is_read and not message.is_archived]
+        if unread:
+            room_ids = {message.room_id for message in unread}
+            Message.objects.filter(room_id__in=room_ids, id__in=[message.id for message in unread]).update(is_read=True)
+            ChatRoom.touch(pk__in=room_ids)
+            for message in unread:
+                message.is_read = True
+        return super().to_representation(messages)
+
+
 class MessageListSerializer(serializers.ModelSerializer):
     sender = serializers.CharField(source='sender.username', read_only=True)
     is_read = serializers.SerializerMethodField()
@@ -84,9 +107,7 @@ class MessageListSerializer(serializers.ModelSerializer):
 
     def get_is_read(self, obj):
         user = self.context['request'].user
-        if obj.sender != user:
-            obj.is_read = True
-            obj.save()
+        if obj.sender_id != user.id:
             return True
         return obj.is_read
 
@@ -100,6 +121,7 @@ class MessageListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Message
+        list_serializer_class = MessageReadListSerializer
         fields = [
             'id',
             'type',
@@ -115,6 +137,34 @@ class MessageListSerializer(serializers.ModelSerializer):
         ]
 
 
+class MessageSearchSerializer(serializers.ModelSerializer):
+    """Search hit; unlike history it does not mark found messages as read"""
+    sender = serializers.CharField(source='sender.username', read_only=True)
+    file = FileSerializer(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Message
+        fields = [
+            'id',
+            'type',
+            'file',
+            'content',
+            'sender_id',
+            'sender',
+            'created_at',
+        ]
+
+
+class ChatSettingsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        data = list(data.all() if hasattr(data, 'all') else data)
+        # plans of every setting in the list are resolved with a single query
+        plan_ids = {plan_id for instance in data if instance.can_chat == 'subscribers'
+                    for plan_id in instance.subscription_plans or []}
+        self.context['subscription_plans'] = SubscriptionPlan.objects.in_bulk(plan_ids) if plan_ids else {}
+        return super().to_representation(data)
+
+
 class ChatSettingsSerializer(serializers.ModelSerializer):
     creator = serializers.HiddenField(default=serializers.CurrentUserDefault())
     subscription_plans = serializers.ListField(child=serializers.IntegerField(), required=False, write_only=True)
@@ -123,21 +173,20 @@ class ChatSettingsSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         if instance.can_chat == 'subscribers':
-            subscription_plans_ids = instance.subscription_plans
-            subscription_plans = []
-            for plan in subscription_plans_ids:
-                plan_instance = SubscriptionPlan.objects.get(pk=plan)
-                subscription_plans.append({
-                    'id': plan_instance.id,
-                    'name': plan_instance.name
-                })
-            representation['subscription_plans'] = subscription_plans
+            plans = self.context.get('subscription_plans')
+            if plans is None:
+                plans = SubscriptionPlan.objects.in_bulk(instance.subscription_plans or [])
+            representation['subscription_plans'] = [
+                {'id': plans[plan_id].id, 'name': plans[plan_id].name}
+                for plan_id in instance.subscription_plans or [] if plan_id in plans
+            ]
         elif instance.can_chat == 'donations':
             representation['minimum_message_donation'] = instance.minimum_message_donation
         return representation
 
     class Meta:
         model = ChatSettings
+        list_serializer_class = ChatSettingsListSerializer
         fields = [
             'id',
             'can_chat',
@@ -145,3 +194,44 @@ class ChatSettingsSerializer(serializers.ModelSerializer):
             'minimum_message_donation',
             'creator',
         ]
+
+
+class BroadcastSerializer(serializers.ModelSerializer):
+    creator = serializers.HiddenField(default=serializers.CurrentUserDefault())
+
+    def validate_file(self, file):
+        """Only a fresh upload that is not attached anywhere yet, or a file the creator already uses"""
+        if file is None:
+            return file
+        user = self.context['request'].user
+        is_own = File.objects.filter(
+            Q(broadcasts__creator=user) | Q(messages__sender=user) | Q(post__user=user), pk=file.pk
+        ).exists()
+        if not is_own and not orphaned_files(older_than=timezone.now()).filter(pk=file.pk).exists():
+            raise APIValidation(_('Файл не найден'), status_code=status.HTTP_400_BAD_REQUEST)
+        return file
+
+    def validate(self, attrs):
+        if not attrs.get('content') and not attrs.get('file'):
+            raise APIValidation(_('Сообщение не может быть пустым'), status_code=status.HTTP_400_BAD_REQUEST)
+        return super().validate(attrs)
+
+    def to_representation(self, instance):
+        representation = super().to_representation(instance)
+        representation['file'] = FileSerializer(instance.file).data if instance.file else None
+        return representation
+
+    class Meta:
+        model = Broadcast
+        fields = [
+            'id',
+            'creator',
+            'content',
+            'file',
+            'type',
+            'status',
+            'recipients_count',
+            'sent_count',
+            'created_at',
+        ]
+        read_only_fields = ['status', 'recipients_count', 'sent_count']
@@ -1,51 +1,170 @@
-from django.db.models import Sum
+import time
+
+from django.core.cache import cache
+from django.db.models import Q, Sum
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from rest_framework import status
 
-from apps.authentication.models import Donation, UserSubscription
+from apps.authentication.models import Donation, UserSubscription, BlockedUser
+from apps.chat.models import ChatRoom, ChatSettings
 from config.core.api_exceptions import APIValidation, APICodeValidation
 
+CHAT_ACCESS_CACHE_TIMEOUT = 60
+CHAT_ROOM_MEMBERS_CACHE_TIMEOUT = 60 * 60 * 24
+CHAT_SETTINGS_CACHE_TIMEOUT = 60 * 60
+
+
+def room_group_name(room_id):
+    return f'chat_{room_id}'
+
+
+def user_group_name(user_id):
+    return f'user_{user_id}'
+
+
+def chat_access_version_key(user_id):
+    return f'chat_access_version:{user_id}'
+
+
+def invalidate_chat_access(*user_ids):
+    """
+    Invalidates every cached chat decision of the given users;
+    cached decisions embed per-user versions, so bumping the version makes old keys unreachable
+    """
+    versions = {chat_access_version_key(user_id): time.time_ns() for user_id in user_ids if user_id}
+    if versions:
+        cache.set_many(versions, timeout=None)
+
+
+def chat_access_cache_key(prefix, *ids, user_ids):
+    version_keys = [chat_access_version_key(user_id) for user_id in user_ids]
+    versions = cache.get_many(version_keys)
+    return ':'.join([prefix, *map(str, ids), *(str(versions.get(key, 0)) for key in version_keys)])
+
+
+def chat_settings_cache_key(creator_id):
+    return f'chat_settings:{creator_id}'
+
+
+def get_chat_settings(creator_id):
+    """Chat settings of the creator, read from the database at most once per cache timeout"""
+    key = chat_settings_cache_key(creator_id)
+    chat_settings = cache.get(key)
+    if chat_settings is None:
+        chat_settings = list(ChatSettings.objects.filter(creator_id=creator_id))
+        cache.set(key, chat_settings, CHAT_SETTINGS_CACHE_TIMEOUT)
+    return chat_settings
+
+
+def invalidate_chat_settings(creator_id):
+    cache.delete(chat_settings_cache_key(creator_id))
+
+
+def get_chatting_denial(user_id, another_user_id):
+    """
+    Evaluates chat settings of another user for the user;
+    returns None when chatting is allowed, otherwise tuple (code, minimum_message_donation)
+    """
+    another_user_configs = {config.can_chat: config for config in get_chat_settings(another_user_id)}
+
+    if 'everyone' in another_user_configs:
+        return None
+    if 'nobody' in another_user_configs:
+        return 'nobody', None
+
+    if 'subscribers' in another_user_configs:
+        is_subscribed = UserSubscription.objects.filter(
+            subscriber_id=user_id,
+            creator_id=another_user_id,
+            end_date__gt=timezone.now()
+        ).exists()
+        if not is_subscribed:
+            return 'subscribers', None
+
+    donation_settings = another_user_configs.get('donations')
+    if donation_settings:
+        if donation_settings.minimum_message_donation <= 0:
+            return 'donations', donation_settings.minimum_message_donation
+        total_donation = Donation.objects.filter(
+            donator_id=user_id,
+            creator_id=another_user_id,
+        ).aggregate(total=Sum('amount'))['total'] or 0
+        if total_donation < donation_settings.minimum_message_donation:
+            return 'donations', donation_settings.minimum_message_donation
+    return None
+
+
+def raise_chatting_denial(code, minimum_message_donation=None):
+    if code == 'subscribers':
+        raise APICodeValidation(
+            _('Вы сможете написать этому креатору только после приобретения любого уровня подписки'),
+            code='subscribers',
+            status_code=status.HTTP_403_FORBIDDEN)
+    if code == 'donations':
+        raise APICodeValidation(
+            _(f'Могут общаться только пользователи которые задонатили этому креатору минимум {minimum_message_donation}'),
+            code='donations',
+            status_code=status.HTTP_403_FORBIDDEN
+        )
+    raise APICodeValidation(_('Этот пользователь закрыл чат'),
+                            code='nobody',
+                            status_code=status.HTTP_403_FORBIDDEN)
+
+
+def cached_chatting_denial(user_id, another_user_id):
+    key = chat_access_cache_key('chat_access', user_id, another_user_id, user_ids=[user_id, another_user_id])
+    denial = cache.get(key)
+    if denial is None:
+        # empty tuple marks an allowed decision, so that it is distinguishable from a cache miss
+        denial = get_chatting_denial(user_id, another_user_id) or ()
+        cache.set(key, denial, CHAT_ACCESS_CACHE_TIMEOUT)
+    return denial
+
 
 def check_chatting_verification(user, another_user):
-    another_user_configs = another_user.chat_settings.all()
-
-    if not another_user_configs.filter(can_chat='everyone').exists():
-        if not another_user_configs.filter(can_chat='nobody').exists():
-            if another_user_configs.filter(can_chat='subscribers').exists():
-                is_subscribed = UserSubscription.objects.filter(
-                    subscriber=user,
-                    creator=another_user,
-                    end_date__gt=timezone.now()
-                ).exists()
-
-                if not is_subscribed:
-                    raise APICodeValidation(
-                        _('Вы сможете написать этому креатору только после приобретения любого уровня подписки'),
-                        code='subscribers',
-                        status_code=status.HTTP_403_FORBIDDEN)
-            if another_user_configs.filter(can_chat='donations').exists():
-                donation_settings = another_user_configs.filter(can_chat='donations').first()
-                if donation_settings.minimum_message_donation <= 0:
-                    raise APICodeValidation(
-                        _(f'Могут общаться только пользователи которые задонатили этому креатору минимум {donation_settings.minimum_message_donation}'),
-                        code='donations',
-                        status_code=status.HTTP_403_FORBIDDEN
-                    )
-                total_donation = Donation.objects.filter(
-                    donator=user,
-                    creator=another_user,
-                ).aggregate(total=Sum('amount'))['total']
-                if total_donation < donation_settings.minimum_message_donation:
-                    raise APICodeValidation(
-                        _(f'Могут общаться только пользователи которые задонатили этому креатору минимум {donation_settings.minimum_message_donation}'),
-                        code='donations',
-                        status_code=status.HTTP_403_FORBIDDEN
-                    )
-            return True
-        else:
-            raise APICodeValidation(_('Этот пользователь закрыл чат'),
-                                    code='nobody',
-                                    status_code=status.HTTP_403_FORBIDDEN)
-    else:
-        return True
+    denial = cached_chatting_denial(user.id, another_user.id)
+    if denial:
+        raise_chatting_denial(*denial)
+    return True
+
+
+def get_room_members(room_id):
+    """Returns (creator_id, subscriber_id) of the room or empty tuple; room members never change"""
+    key = f'chat_room_members:{room_id}'
+    members = cache.get(key)
+    if members is None:
+        members = ChatRoom.objects.filter(pk=room_id).values_list('creator_id', 'subscriber_id').first() or ()
+        cache.set(key, tuple(members), CHAT_ROOM_MEMBERS_CACHE_TIMEOUT if members else CHAT_ACCESS_CACHE_TIMEOUT)
+    return tuple(members)
+
+
+def check_room_access(room_id, user_id):
+    """Cached per-(room, user) access decision used by websocket connections"""
+    members = get_room_members(room_id)
+    if user_id not in members:
+        return False
+    creator_id, subscriber_id = members
+    another_user_id = creator_id if user_id != creator_id else subscriber_id
+
+    key = chat_access_cache_key('chat_room_access', room_id, user_id, user_ids=[user_id, another_user_id])
+    is_allowed = cache.get(key)
+    if is_allowed is None:
+        is_allowed = (not BlockedUser.is_blocked(user_id, another_user_id) and
+                      not cached_chatting_denial(user_id, another_user_id))
+        cache.set(key, is_allowed, CHAT_ACCESS_CACHE_TIMEOUT)
+    return is_allowed
+
+
+def get_chat_partner_ids(user_id, user_ids):
+    """Those of user_ids the user has a chat room with, except users blocked by or blocking the user"""
+    rooms = ChatRoom.objects.filter(
+        Q(creator_id=user_id, subscriber_id__in=user_ids) | Q(subscriber_id=user_id, creator_id__in=user_ids)
+    ).values_list('creator_id', 'subscriber_id')
+    partner_ids = {creator_id if creator_id != user_id else subscriber_id for creator_id, subscriber_id in rooms}
+    if partner_ids:
+        blocks = BlockedUser.objects.filter(
+            Q(blocker_id=user_id, blocked_id__in=partner_ids) | Q(blocked_id=user_id, blocker_id__in=partner_ids)
+        ).values_list('blocker_id', 'blocked_id')
+        partner_ids -= {blocked_user_id for block in blocks for blocked_user_id in block}
+    return [partner_id for partner_id in user_ids if partner_id in partner_ids]
@@ -32,4 +32,29 @@ chat_settings_swagger = {
                     ]
                 }
             )
-        }
\ No newline at end of file
+        }
+message_history_swagger_params = [
+    openapi.Parameter('before', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                      description='Messages older than this message ID'),
+    openapi.Parameter('after', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                      description='Messages newer than this message ID'),
+    openapi.Parameter('around', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                      description='Messages around this message ID, the anchor message included'),
+    openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+]
+
+chat_room_sync_swagger_params = [
+    openapi.Parameter('sync_token', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                      description='Token from the previous sync response, omit it for the full inbox'),
+]
+
+message_search_swagger_params = [
+    openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                      description='Search query, supports "quoted phrases", OR and -exclusions'),
+    *message_history_swagger_params,
+]
+
+chat_presence_swagger_params = [
+    openapi.Parameter('user_ids', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+                      description='Comma separated user IDs of chat partners, at most 200; other users are left out'),
+]
@@ -0,0 +1,17 @@
+from celery import shared_task
+from django.conf import settings
+
+from apps.chat.broadcasts import send_broadcast
+from apps.chat.partitions import ensure_message_partitions, archive_old_message_partitions
+
+
+@shared_task
+def manage_message_partitions_task():
+    ensure_message_partitions()
+    if settings.CHAT_MESSAGE_ARCHIVE_ENABLED:
+        archive_old_message_partitions()
+
+
+@shared_task
+def send_broadcast_task(broadcast_id):
+    return send_broadcast(broadcast_id)
@@ -1,3 +1,65 @@
-from django.test import TestCase
+import threading
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.authentication.models import User
+from apps.chat.models import ChatRoom, Message
+
+
+def run_in_thread(func):
+    """Runs func on its own database connection, i.e. in a transaction separate from the caller's"""
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func()
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+class ChatRoomSyncTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='998900000001', username='sync_user')
+        self.rooms = []
+        for number in (2, 3):
+            partner = User.objects.create_user(phone_number=f'99890000000{number}', username=f'sync_partner_{number}')
+            room = ChatRoom.objects.create(creator=self.user, subscriber=partner)
+            Message.objects.create(room=room, sender=partner, content='hello')
+            self.rooms.append(room)
+
+    def sync(self, sync_token=None):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse('chat:chat_room_sync'), {'sync_token': sync_token} if sync_token else {})
+        self.assertEqual(response.status_code, 200)
+        return response.data['sync_token'], {room['id'] for room in response.data['results']}
+
+    def test_full_sync_returns_every_room(self):
+        _, room_ids = self.sync()
+        self.assertEqual(room_ids, {room.id for room in self.rooms})
+
+    def test_room_committed_after_a_later_transaction_is_not_skipped(self):
+        slow_room, fast_room = self.rooms
+        sync_token, _ = self.sync()
+
+        with transaction.atomic():
+            # the slow transaction touches its room first and commits last
+            ChatRoom.touch(pk=slow_room.pk)
+            run_in_thread(lambda: ChatRoom.touch(pk=fast_room.pk))
+            sync_token, room_ids = run_in_thread(lambda: self.sync(sync_token))
+            self.assertIn(fast_room.id, room_ids)
+
+        _, room_ids = self.sync(sync_token)
+        self.assertIn(slow_room.id, room_ids)
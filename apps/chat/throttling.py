@@ -0,0 +1,61 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger()
+
+METRICS = (
+    'rate_limited_connection',
+    'rate_limited_user',
+    'closed_abusive',
+    'closed_slow_consumer',
+)
+
+
+class TokenBucket:
+    """In-process token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self, tokens=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+async def consume_user_quota(user_id):
+    """Fixed window counter per user, shared by all Daphne processes through the cache (Redis)"""
+    window = settings.CHAT_FLOW_CONTROL['USER_WINDOW']
+    key = f'chat_rate:{user_id}:{int(time.time() // window)}'
+    await cache.aadd(key, 0, timeout=window * 2)
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        # key was evicted between add and incr
+        await cache.aset(key, 1, timeout=window * 2)
+        count = 1
+    return count <= settings.CHAT_FLOW_CONTROL['USER_MESSAGES_PER_WINDOW']
+
+
+async def incr_metric(name, delta=1):
+    key = f'chat_metrics:{name}'
+    try:
+        await cache.aincr(key, delta)
+    except ValueError:
+        await cache.aset(key, delta, timeout=None)
+    logger.warning(f'Chat flow control: {name};')
+
+
+def get_metrics():
+    values = cache.get_many([f'chat_metrics:{name}' for name in METRICS])
+    return {name: values.get(f'chat_metrics:{name}', 0) for name in METRICS}
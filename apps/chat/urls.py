@@ -1,13 +1,21 @@
 from django.urls import path
 
 from apps.chat.views import (UserGetChatRoomAPIView, LastMessagesAPIView, UserChatRoomListAPIView,
-                             ConfigureChatSettingsAPIView, GetChatSettingsAPIView)
+                             ConfigureChatSettingsAPIView, GetChatSettingsAPIView, MessageHistoryAPIView,
+                             UserChatRoomSyncAPIView, BroadcastCreateAPIView, BroadcastRetrieveAPIView,
+                             MessageSearchAPIView, ChatPresenceAPIView)
 
 app_name = 'chat'
 urlpatterns = [
     path('rooms/', UserChatRoomListAPIView.as_view(), name='chat_room_list'),
+    path('rooms/sync/', UserChatRoomSyncAPIView.as_view(), name='chat_room_sync'),
     path('get-user-room/<int:user_id>/', UserGetChatRoomAPIView.as_view(), name='chat_get_room'),
     path('last-messages/<int:room_id>/', LastMessagesAPIView.as_view(), name='chat_last_messages'),
+    path('history/<int:room_id>/', MessageHistoryAPIView.as_view(), name='chat_message_history'),
+    path('search/<int:room_id>/', MessageSearchAPIView.as_view(), name='chat_message_search'),
+    path('presence/', ChatPresenceAPIView.as_view(), name='chat_presence'),
+    path('broadcasts/', BroadcastCreateAPIView.as_view(), name='chat_broadcast_create'),
+    path('broadcasts/<int:pk>/', BroadcastRetrieveAPIView.as_view(), name='chat_broadcast_detail'),
 
     path('get-settings/', GetChatSettingsAPIView.as_view(), name='get_chat_settings'),
     path('configure-settings/', ConfigureChatSettingsAPIView.as_view(), name='configure_chat_settings'),
@@ -1,20 +1,31 @@
-from django.db.models import Q, Count, OuterRef, Subquery
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector, SearchQuery
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q, Count, OuterRef, Subquery, Exists
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
 from rest_framework.filters import OrderingFilter
-from rest_framework.generics import ListAPIView
+from rest_framework.generics import ListAPIView, CreateAPIView, RetrieveAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.utils.translation import gettext_lazy as _
 
 from apps.authentication.models import User, BlockedUser
-from apps.chat.models import ChatRoom, Message, ChatSettings
-from apps.chat.serializers import MessageListSerializer, UserChatRoomListSerializer, ChatSettingsSerializer
-from apps.chat.services import check_chatting_verification
-from apps.chat.swagger import chat_settings_swagger
+from apps.chat.models import ChatRoom, Message, ChatSettings, Broadcast, MESSAGE_SEARCH_CONFIG
+from apps.chat.partitions import load_archived_messages
+from apps.chat.presence import get_presence
+from apps.chat.serializers import (MessageListSerializer, UserChatRoomListSerializer, ChatSettingsSerializer,
+                                  BroadcastSerializer, MessageSearchSerializer)
+from apps.chat.services import (check_chatting_verification, invalidate_chat_access, get_room_members,
+                               get_chat_settings, invalidate_chat_settings, get_chat_partner_ids)
+from apps.chat.swagger import (chat_settings_swagger, message_history_swagger_params, chat_room_sync_swagger_params,
+                               message_search_swagger_params, chat_presence_swagger_params)
+from apps.chat.tasks import send_broadcast_task
 from apps.files.serializers import FileSerializer
 from config.core.api_exceptions import APIValidation, APICodeValidation
-from config.core.pagination import APILimitOffsetPagination
+from config.core.pagination import APILimitOffsetPagination, APIKeysetPagination
+from config.core.permissions import IsCreator
 
 
 class UserChatRoomListAPIView(ListAPIView):
@@ -45,6 +56,46 @@ class UserChatRoomListAPIView(ListAPIView):
         return queryset
 
 
+class UserChatRoomSyncAPIView(APIView):
+    """
+    Delta sync of the inbox: only rooms changed since the given sync token are returned;
+    rooms changed by transactions that were still running at the previous sync may be returned once more
+    """
+    serializer_class = UserChatRoomListSerializer
+    # tokens hold a transaction id watermark, tokens of the former sequence based sync are rejected
+    sync_token_salt = 'chat.inbox.sync.xid'
+
+    def get_since(self, request):
+        sync_token = request.query_params.get('sync_token')
+        if not sync_token:
+            return 0
+        try:
+            return int(signing.loads(sync_token, salt=self.sync_token_salt))
+        except (signing.BadSignature, TypeError, ValueError):
+            raise APICodeValidation(_('Неверный токен синхронизации'), code='invalid_sync_token',
+                                    status_code=status.HTTP_400_BAD_REQUEST)
+
+    @swagger_auto_schema(manual_parameters=chat_room_sync_swagger_params)
+    def get(self, request, *args, **kwargs):
+        user = request.user
+        since = self.get_since(request)
+        # taken before the query: transactions still running now are returned again by the next sync
+        watermark = ChatRoom.sync_watermark()
+
+        rooms = list(
+            ChatRoom.objects
+            .filter(Q(creator=user) | Q(subscriber=user), sync_seq__gte=since)
+            .filter(Exists(Message.objects.filter(room=OuterRef('pk'))))
+            .select_related('creator__profile_photo', 'subscriber__profile_photo')
+            .order_by('sync_seq')
+        )
+        serializer = self.serializer_class(rooms, many=True, context={'request': request})
+        return Response({
+            'sync_token': signing.dumps(max(watermark, since), salt=self.sync_token_salt),
+            'results': serializer.data,
+        })
+
+
 class UserGetChatRoomAPIView(APIView):
     @staticmethod
     def get_user(user_id):
@@ -112,13 +163,100 @@ class LastMessagesAPIView(ListAPIView):
         return queryset
 
 
+class MessageHistoryAPIView(ListAPIView):
+    queryset = Message.objects.all()
+    serializer_class = MessageListSerializer
+    pagination_class = APIKeysetPagination
+
+    @swagger_auto_schema(manual_parameters=message_history_swagger_params)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        room_id = self.kwargs['room_id']
+        if self.request.user.id not in get_room_members(room_id):
+            raise APIValidation(_('Чат не найден'), status_code=status.HTTP_404_NOT_FOUND)
+
+        queryset = super().get_queryset()
+        queryset = queryset.filter(room_id=room_id).select_related('sender', 'file')
+        return queryset
+
+    def paginate_queryset(self, queryset):
+        """Pages running past the oldest live partition continue from the MinIO archive"""
+        page = super().paginate_queryset(queryset)
+        paginator = self.paginator
+        if paginator.param in (None, 'before') and not paginator.has_before:
+            before_id = page[-1].id if page else paginator.cursor
+            archived, paginator.has_before = load_archived_messages(
+                self.kwargs['room_id'], before_id, paginator.limit - len(page)
+            )
+            page += archived
+            paginator.items = page
+        return page
+
+
+class MessageSearchAPIView(ListAPIView):
+    """
+    Full-text search inside one room, newest hits first;
+    hit IDs can be passed to the history endpoint as the `around` cursor. Archived messages are not searched
+    """
+    queryset = Message.objects.all()
+    serializer_class = MessageSearchSerializer
+    pagination_class = APIKeysetPagination
+
+    @swagger_auto_schema(manual_parameters=message_search_swagger_params)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        room_id = self.kwargs['room_id']
+        if self.request.user.id not in get_room_members(room_id):
+            raise APIValidation(_('Чат не найден'), status_code=status.HTTP_404_NOT_FOUND)
+
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            raise APIValidation(_('Введите поисковый запрос'), status_code=status.HTTP_400_BAD_REQUEST)
+
+        queryset = super().get_queryset()
+        queryset = (
+            queryset
+            .filter(room_id=room_id)
+            # same expression as chat_message_content_fts_idx, so that the index is used
+            .alias(search=SearchVector('content', config=MESSAGE_SEARCH_CONFIG))
+            .filter(search=SearchQuery(query, config=MESSAGE_SEARCH_CONFIG, search_type='websearch'))
+            .select_related('sender', 'file')
+        )
+        return queryset
+
+
+class ChatPresenceAPIView(APIView):
+    """
+    Online status and last seen time of up to CHAT_PRESENCE['BATCH_SIZE'] users, served from the cache;
+    only chat partners are reported, users without a room with the requester or blocked either way are left out
+    """
+
+    @swagger_auto_schema(manual_parameters=chat_presence_swagger_params)
+    def get(self, request, *args, **kwargs):
+        try:
+            user_ids = list(dict.fromkeys(
+                int(user_id) for user_id in request.query_params.get('user_ids', '').split(',') if user_id
+            ))
+        except ValueError:
+            raise APIValidation(_('Неверный список пользователей'), status_code=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > settings.CHAT_PRESENCE['BATCH_SIZE']:
+            raise APIValidation(_('Слишком много пользователей в запросе'), status_code=status.HTTP_400_BAD_REQUEST)
+
+        user_ids = get_chat_partner_ids(request.user.id, user_ids)
+        return Response({'results': get_presence(user_ids)}, status=status.HTTP_200_OK)
+
+
 class GetChatSettingsAPIView(APIView):
     serializer_class = ChatSettingsSerializer
 
     @swagger_auto_schema(responses=chat_settings_swagger)
     def get(self, request, *args, **kwargs):
         user = request.user
-        chat_settings = ChatSettings.objects.filter(creator=user)
+        chat_settings = get_chat_settings(user.id)
         serializer = self.serializer_class(chat_settings, many=True)
         data = serializer.data
 
@@ -134,5 +272,25 @@ class ConfigureChatSettingsAPIView(APIView):
         serializer = self.serializer_class(data=request.data, many=True, context={'request': request})
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        invalidate_chat_settings(request.user.id)
+        invalidate_chat_access(request.user.id)
 
         return Response(serializer.data)
+
+
+class BroadcastCreateAPIView(CreateAPIView):
+    """Sends a message of the creator to every active subscriber, delivery runs in the background"""
+    serializer_class = BroadcastSerializer
+    permission_classes = [IsCreator, ]
+
+    def perform_create(self, serializer):
+        broadcast = serializer.save()
+        transaction.on_commit(lambda: send_broadcast_task.delay(broadcast.id))
+
+
+class BroadcastRetrieveAPIView(RetrieveAPIView):
+    serializer_class = BroadcastSerializer
+    permission_classes = [IsCreator, ]
+
+    def get_queryset(self):
+        return Broadcast.objects.filter(creator=self.request.user).select_related('file')
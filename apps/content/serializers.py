@@ -6,10 +6,11 @@ from rest_framework import serializers, status
 
 from apps.authentication.models import User, UserPermissions, PermissionTypes
 from apps.authentication.serializers.user import BecomeCreatorSerializer
-from apps.content.models import Post, Category, AnswerOption, PostAnswer, Comment, Report, ReportComment
+from apps.content.models import Post, PostTypes, Category, AnswerOption, PostAnswer, Comment, Report, ReportComment
 from apps.content.services import calculate_correct_answers
 from apps.files.models import File
-from apps.files.serializers import FileSerializer
+from apps.files.serializers import FileSerializer, PostFileSerializer
+from apps.files.transcoding import queue_transcoding
 from config.core.api_exceptions import APIValidation
 
 
@@ -93,6 +94,8 @@ class PostCreateSerializer(serializers.ModelSerializer):
             post = Post.objects.create(**validated_data)
             if files:
                 post.files.add(*files)
+                if post.post_type in (PostTypes.photo_video, PostTypes.music):
+                    queue_transcoding(files)
             if answers and validated_data.get('post_type') == 'questionnaire':
                 answers_list = []
                 for answer in answers:
@@ -240,7 +243,7 @@ class QuestionnairePostAnswerSerializer(serializers.ModelSerializer):
 class PostListSerializer(serializers.ModelSerializer):
     user = BecomeCreatorSerializer(allow_null=True, read_only=True)
     post_type_display = serializers.CharField(source='get_post_type_display', read_only=True)
-    files = FileSerializer(read_only=True, allow_null=True, many=True)
+    files = PostFileSerializer(read_only=True, allow_null=True, many=True)
     has_liked = serializers.SerializerMethodField()
     can_view = serializers.SerializerMethodField()
     is_saved = serializers.SerializerMethodField()
@@ -316,7 +319,7 @@ class PostShowSerializer(serializers.ModelSerializer):
     username = serializers.CharField(read_only=True, allow_null=True, source='user.username')
     profile_photo_info = FileSerializer(read_only=True, allow_null=True, source='user.profile_photo')
     post_type_display = serializers.CharField(source='get_post_type_display', read_only=True)
-    files = FileSerializer(read_only=True, allow_null=True, many=True)
+    files = PostFileSerializer(read_only=True, allow_null=True, many=True)
     has_liked = serializers.SerializerMethodField()
     answers = AnswerOptionSerializer(many=True, read_only=True)
 
@@ -0,0 +1,131 @@
+import io
+import json
+import resource
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from apps.files.models import File
+from apps.files.utils import delete_file
+
+CHUNK = b'\0' * (1024 * 1024)
+
+
+def current_rss():
+    """Resident set size of this process in bytes, read from procfs"""
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='rss-sampler', daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+class MultipartStream(io.RawIOBase):
+    """Multipart/form-data body with a zero filled file part, generated on the fly instead of held in memory"""
+
+    def __init__(self, boundary, filename, size):
+        self.parts = iter(self.generate(boundary, filename, size))
+        self.buffer = b''
+
+    @staticmethod
+    def generate(boundary, filename, size):
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+               f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        while size > 0:
+            yield CHUNK[:min(size, len(CHUNK))]
+            size -= len(CHUNK)
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    @staticmethod
+    def length(boundary, filename, size):
+        return sum(len(part) for part in MultipartStream.generate(boundary, filename, 0)) + size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.buffer:
+            self.buffer = next(self.parts, b'')
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+class Command(BaseCommand):
+    help = ('Uploads a generated file through the whole request stack of FileCreateAPIView '
+            '(middleware, upload handlers, S3 multipart upload) and reports elapsed time and peak RSS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=int, default=500)
+        parser.add_argument('--sample-interval', type=float, default=0.05, help='Seconds between RSS samples')
+        parser.add_argument('--keep', action='store_true', help='Keep the uploaded object and its File row')
+
+    def handle(self, *args, **options):
+        size = options['size_mb'] * 1024 * 1024
+        boundary = uuid.uuid4().hex
+        filename = f'upload-benchmark-{boundary[:8]}.bin'
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': reverse('files:file_create'),
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': f'multipart/form-data; boundary={boundary}',
+            'CONTENT_LENGTH': str(MultipartStream.length(boundary, filename, size)),
+            'wsgi.input': io.BufferedReader(MultipartStream(boundary, filename, size)),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': self.stderr,
+        }
+        handler = WSGIHandler()
+        response_status = []
+
+        baseline = current_rss()
+        sampler = RSSSampler(options['sample_interval'])
+        sampler.start()
+        started = time.perf_counter()
+        body = b''.join(handler(environ, lambda status, headers, exc_info=None: response_status.append(status)))
+        elapsed = time.perf_counter() - started
+        peak = sampler.stop()
+
+        if not response_status or not response_status[0].startswith('201'):
+            raise CommandError(f'Upload failed: {response_status and response_status[0]} {body[:500]!r}')
+
+        self.stdout.write(f'size               {size / 1024 / 1024:.0f} MB')
+        self.stdout.write(f'elapsed            {elapsed:.2f} s')
+        self.stdout.write(f'throughput         {size / 1024 / 1024 / elapsed:.1f} MB/s')
+        self.stdout.write(f'rss baseline       {baseline / 1024 / 1024:.1f} MB')
+        self.stdout.write(f'rss peak           {peak / 1024 / 1024:.1f} MB')
+        self.stdout.write(f'rss growth         {(peak - baseline) / 1024 / 1024:.1f} MB')
+        # ru_maxrss is in kilobytes on Linux and covers the whole life of the process
+        self.stdout.write(f'ru_maxrss          {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB')
+        self.stdout.write(f"multipart parts    {settings.AWS_S3_MULTIPART_CHUNK_SIZE / 1024 / 1024:.0f} MB "
+                          f"x {settings.AWS_S3_MULTIPART_CONCURRENCY}")
+
+        if not options['keep']:
+            file = File.objects.get(pk=json.loads(body)['file'])
+            delete_file(file)
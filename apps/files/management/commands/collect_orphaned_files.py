@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.files.orphans import collect_orphaned_files, get_metrics
+
+
+class Command(BaseCommand):
+    help = 'Deletes files that nothing references after the grace period, together with their MinIO objects'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orphaned files and their size')
+
+    def handle(self, *args, **options):
+        report = collect_orphaned_files(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"orphaned files     {report['files']}")
+            self.stdout.write(f"size               {report['bytes'] / 1024 / 1024:.1f} MB")
+            return
+
+        for name, value in report.items():
+            self.stdout.write(f'{name:<19}{value}')
+        self.stdout.write('totals')
+        for name, value in get_metrics().items():
+            self.stdout.write(f'  {name:<17}{value}')
@@ -0,0 +1,36 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from config.core import media_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows hit and miss counters and disk usage of the local media cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Run an eviction pass before reporting')
+
+    def handle(self, *args, **options):
+        if options['evict']:
+            evicted = media_cache.evict()
+            media_cache.incr_metric('evicted', evicted)
+            self.stdout.write(f'evicted            {evicted}')
+
+        files_count, total_size = 0, 0
+        for root, _, names in os.walk(settings.MEDIA_CACHE['DIR']):
+            for name in names:
+                if not name.endswith(media_cache.TEMP_SUFFIX):
+                    files_count += 1
+                    total_size += os.path.getsize(os.path.join(root, name))
+
+        metrics = media_cache.get_metrics()
+        lookups = metrics['hit'] + metrics['miss']
+        self.stdout.write(f"enabled            {settings.MEDIA_CACHE['ENABLED']}")
+        for name, value in metrics.items():
+            self.stdout.write(f'{name:<19}{value}')
+        self.stdout.write(f"hit ratio          {metrics['hit'] / lookups if lookups else 0:.2%}")
+        self.stdout.write(f'files              {files_count}')
+        self.stdout.write(f"size               {total_size / 1024 / 1024:.1f} / "
+                          f"{settings.MEDIA_CACHE['MAX_SIZE'] / 1024 / 1024:.0f} MB")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Обрабатывается'), ('ready', 'Готов'), ('failed', 'Ошибка обработки')], default='ready', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2 on 2026-10-19 19:05
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_file_status_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=300)),
+                ('gen_name', models.CharField(max_length=100)),
+                ('content_type', models.CharField(max_length=100, null=True)),
+                ('size', models.BigIntegerField()),
+                ('chunk_size', models.IntegerField()),
+                ('checksum', models.CharField(blank=True, max_length=64, null=True)),
+                ('upload_id', models.CharField(max_length=1024)),
+                ('status', models.CharField(choices=[('active', 'Загружается'), ('completing', 'Завершается'), ('completed', 'Завершена'), ('failed', 'Ошибка')], default='active', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='files.file')),
+            ],
+            options={
+                'db_table': 'file_upload_session',
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadSessionPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('number', models.PositiveIntegerField()),
+                ('size', models.IntegerField()),
+                ('etag', models.CharField(max_length=100)),
+                ('checksum', models.CharField(max_length=64)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='files.uploadsession')),
+            ],
+            options={
+                'db_table': 'file_upload_session_part',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='uploadsession',
+            index=models.Index(fields=['expires_at'], name='file_upload_session_exp_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='uploadsessionpart',
+            constraint=models.UniqueConstraint(fields=('session', 'number'), name='file_upload_session_part_unique'),
+        ),
+    ]
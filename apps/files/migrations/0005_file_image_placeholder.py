@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_file_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='blurhash',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_file_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='gen_name',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+    ]
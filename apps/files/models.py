@@ -1,15 +1,77 @@
+import uuid
+
 from django.db import models
+from django.utils.translation import gettext_lazy as _
 
 from config.models import BaseModel
 
 
+class FileStatusEnum(models.TextChoices):
+    processing = 'processing', _('Обрабатывается')
+    ready = 'ready', _('Готов')
+    failed = 'failed', _('Ошибка обработки')
+
+
 class File(BaseModel):
     name = models.CharField(max_length=300, null=True)
-    gen_name = models.CharField(max_length=100, null=True)
+    gen_name = models.CharField(max_length=100, null=True, db_index=True)
     size = models.FloatField(null=True)
     path = models.TextField(null=True)
     content_type = models.CharField(max_length=100, null=True)
     extension = models.CharField(max_length=30, null=True)
+    status = models.CharField(choices=FileStatusEnum.choices, default=FileStatusEnum.ready, max_length=20)
+    # {variant name: {'gen_name', 'path', 'size', 'content_type', 'width', 'height'}} built in the background
+    variants = models.JSONField(default=dict, blank=True)
+    # intrinsic size and blurhash placeholder of images, filled by process_image_task
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    blurhash = models.CharField(max_length=100, null=True, blank=True)
+    # sha256 of the content; rows of duplicate uploads share one stored object (gen_name) and hash
+    sha256 = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
     class Meta:
         db_table = "file"
+
+
+class UploadSessionStatusEnum(models.TextChoices):
+    active = 'active', _('Загружается')
+    completing = 'completing', _('Завершается')
+    completed = 'completed', _('Завершена')
+    failed = 'failed', _('Ошибка')
+
+
+class UploadSession(BaseModel):
+    """Resumable upload: the file is sent in chunk_size pieces, each stored as a part of an S3 multipart upload"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=300)
+    gen_name = models.CharField(max_length=100)
+    content_type = models.CharField(max_length=100, null=True)
+    size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    # sha256 hex digest of the whole file, verified on completion when given
+    checksum = models.CharField(max_length=64, null=True, blank=True)
+    upload_id = models.CharField(max_length=1024)
+    status = models.CharField(choices=UploadSessionStatusEnum.choices, default=UploadSessionStatusEnum.active,
+                              max_length=20)
+    expires_at = models.DateTimeField()
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        db_table = 'file_upload_session'
+        indexes = [
+            models.Index(fields=['expires_at'], name='file_upload_session_exp_idx'),
+        ]
+
+
+class UploadSessionPart(BaseModel):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='parts')
+    number = models.PositiveIntegerField()
+    size = models.IntegerField()
+    etag = models.CharField(max_length=100)
+    checksum = models.CharField(max_length=64)
+
+    class Meta:
+        db_table = 'file_upload_session_part'
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'number'], name='file_upload_session_part_unique'),
+        ]
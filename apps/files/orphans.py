@@ -0,0 +1,119 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, Exists, F, Func, OuterRef, Sum
+from django.utils import timezone
+
+from apps.chat.models import ArchivedMessageChunk
+from apps.files.models import File
+from apps.files.utils import delete_objects, upload_path
+
+logger = logging.getLogger()
+
+METRICS = ('runs', 'files_deleted', 'objects_deleted', 'bytes_deleted')
+# (model label, field name) of references that do not keep a file alive, their rows go away with the file
+WEAK_FILE_REFERENCES = {
+    ('authentication.userviewhistory', 'content'),
+    ('files.uploadsession', 'file'),
+}
+
+
+def incr_metric(name, delta=1):
+    key = f'file_gc_metrics:{name}'
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+
+
+def get_metrics():
+    values = cache.get_many([f'file_gc_metrics:{name}' for name in METRICS])
+    return {name: values.get(f'file_gc_metrics:{name}', 0) for name in METRICS}
+
+
+def orphaned_files(older_than=None):
+    """
+    Files created before older_than that nothing references, as one anti-join per relation;
+    every foreign key, one-to-one and many-to-many to File is discovered from the model meta,
+    base managers are used, so soft deleted rows still count as references
+    """
+    older_than = older_than or timezone.now() - timedelta(seconds=settings.FILE_GC['GRACE_PERIOD'])
+    queryset = File.objects.filter(created_at__lt=older_than)
+    for relation in File._meta.related_objects:
+        if (relation.related_model._meta.label_lower, relation.field.name) in WEAK_FILE_REFERENCES:
+            continue
+        if relation.many_to_many:
+            references = relation.through._base_manager.filter(
+                **{relation.field.m2m_reverse_field_name(): OuterRef('pk')})
+        else:
+            references = relation.related_model._base_manager.filter(**{relation.field.name: OuterRef('pk')})
+        queryset = queryset.filter(~Exists(references))
+
+    # archived chat messages keep their file ids in an array instead of a foreign key
+    archived_file_ids = ArchivedMessageChunk.objects.annotate(
+        file_id=Func(F('file_ids'), function='unnest', output_field=BigIntegerField())
+    ).values('file_id')
+    return queryset.exclude(pk__in=archived_file_ids)
+
+
+def object_keys(file: File) -> list:
+    keys = [upload_path(file.gen_name)]
+    for variant in (file.variants or {}).values():
+        keys += [upload_path(gen_name) for gen_name in variant.get('files', [variant['gen_name']])]
+    return keys
+
+
+def delete_orphaned_chunk(file_ids) -> dict:
+    """
+    Deletes the rows of one chunk and, after commit, the objects no other row shares;
+    rows locked by a concurrent duplicate upload are skipped and checked again on the next run
+    """
+    with transaction.atomic():
+        files = list(orphaned_files().filter(pk__in=file_ids).select_for_update(skip_locked=True, of=('self',)))
+        pks = [file.pk for file in files]
+        # duplicate uploads share one object, it stays while any other row references it
+        shared_gen_names = set(
+            File.objects.filter(sha256__in={file.sha256 for file in files if file.sha256})
+            .exclude(pk__in=pks)
+            .values_list('gen_name', flat=True)
+        )
+        keys, seen_gen_names, size = [], set(), 0
+        for file in files:
+            if not file.gen_name or file.gen_name in shared_gen_names or file.gen_name in seen_gen_names:
+                continue
+            seen_gen_names.add(file.gen_name)
+            keys += object_keys(file)
+            size += int(file.size or 0) + sum(variant.get('size', 0) for variant in (file.variants or {}).values())
+        File.objects.filter(pk__in=pks).delete()
+        transaction.on_commit(lambda: delete_objects(keys))
+    return {'files_deleted': len(pks), 'objects_deleted': len(keys), 'bytes_deleted': size}
+
+
+def collect_orphaned_files(dry_run=False) -> dict:
+    """Finds orphaned files and deletes them in BATCH_SIZE chunks, returns the totals"""
+    candidates = orphaned_files().order_by('pk')
+    if dry_run:
+        totals = candidates.aggregate(files=Count('pk'), size=Sum('size'))
+        return {'files': totals['files'] or 0, 'bytes': int(totals['size'] or 0)}
+
+    report = dict.fromkeys(METRICS[1:], 0)
+    last_pk = 0
+    while True:
+        file_ids = list(
+            candidates.filter(pk__gt=last_pk).values_list('pk', flat=True)[:settings.FILE_GC['BATCH_SIZE']]
+        )
+        if not file_ids:
+            break
+        last_pk = file_ids[-1]
+        for name, value in delete_orphaned_chunk(file_ids).items():
+            report[name] += value
+
+    incr_metric('runs')
+    for name, value in report.items():
+        if value:
+            incr_metric(name, value)
+    logger.info(f'Orphaned files collected: {report};')
+    return report
@@ -1,13 +1,104 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 
-from apps.files.models import File
+from apps.files.models import File, FileStatusEnum, UploadSession, UploadSessionStatusEnum
+from apps.files.uploads import missing_offsets
+
+# variants played instead of the original, by preference; AAC plays everywhere, Opus is smaller
+STREAM_VARIANTS = ('hls', 'aac', 'opus')
+# variant served as `path` of a ready image, the uncompressed upload stays available as `original_path`
+DEFAULT_IMAGE_VARIANT = 'compressed'
 
 
 class FileSerializer(serializers.ModelSerializer):
+    path = serializers.SerializerMethodField()
+    original_path = serializers.CharField(source='path', read_only=True)
+    variants = serializers.SerializerMethodField()
+
+    def get_path(self, obj):
+        """Compressed version of a processed image, so that existing clients download fewer bytes"""
+        if obj.status == FileStatusEnum.ready and DEFAULT_IMAGE_VARIANT in (obj.variants or {}):
+            return obj.variants[DEFAULT_IMAGE_VARIANT]['path']
+        return obj.path
+
+    def get_variants(self, obj):
+        """Paths of the responsive versions of an image, empty until its processing has finished"""
+        return {name: variant['path'] for name, variant in (obj.variants or {}).items()}
+
     class Meta:
         model = File
         fields = [
             'name',
             'size',
             'path',
+            'original_path',
+            'status',
+            'variants',
+            'width',
+            'height',
+            'blurhash',
         ]
+
+
+class PostFileSerializer(FileSerializer):
+    stream_path = serializers.SerializerMethodField()
+
+    def get_stream_path(self, obj):
+        """Transcoded version to play once it is ready, the original otherwise"""
+        if obj.status == FileStatusEnum.ready:
+            for variant in STREAM_VARIANTS:
+                if variant in (obj.variants or {}):
+                    return obj.variants[variant]['path']
+        return self.get_path(obj)
+
+    class Meta(FileSerializer.Meta):
+        fields = FileSerializer.Meta.fields + ['content_type', 'stream_path']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    checksum = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_null=True,
+                                      help_text='sha256 hex digest of the whole file')
+    missing_offsets = serializers.SerializerMethodField()
+
+    def validate_size(self, value):
+        if value < 1 or value > settings.FILE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(_('Размер файла превысил 500 МБ!'))
+        return value
+
+    def get_missing_offsets(self, obj):
+        """Offsets of the chunks the client still has to send"""
+        if obj.status != UploadSessionStatusEnum.active:
+            return []
+        return missing_offsets(obj)
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id',
+            'name',
+            'size',
+            'content_type',
+            'checksum',
+            'chunk_size',
+            'status',
+            'expires_at',
+            'missing_offsets',
+            'file',
+        ]
+        read_only_fields = ['chunk_size', 'status', 'expires_at', 'file']
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=300)
+    size = serializers.IntegerField(min_value=1)
+    content_type = serializers.CharField(max_length=100, required=False, allow_null=True)
+
+    def validate_size(self, value):
+        if value > settings.FILE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(_('Размер файла превысил 500 МБ!'))
+        return value
+
+
+class DirectUploadCompleteSerializer(serializers.Serializer):
+    token = serializers.CharField()
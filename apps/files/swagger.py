@@ -0,0 +1,12 @@
+from drf_yasg import openapi
+
+upload_chunk_swagger_params = [
+    openapi.Parameter(
+        'offset', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=True,
+        description='Byte offset of the chunk, a multiple of chunk_size of the session',
+    ),
+    openapi.Parameter(
+        'X-Chunk-Checksum', openapi.IN_HEADER, type=openapi.TYPE_STRING, required=False,
+        description='sha256 hex digest of the chunk, the chunk is rejected if it does not match',
+    ),
+]
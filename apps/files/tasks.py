@@ -0,0 +1,50 @@
+import logging
+
+from celery import shared_task
+
+from apps.files.models import File, FileStatusEnum
+from apps.files.orphans import collect_orphaned_files
+from apps.files.transcoding import build_media_variants, time_limit
+from apps.files.uploads import cleanup_upload_sessions, cleanup_direct_uploads
+from apps.files.utils import file_references, process_image
+
+logger = logging.getLogger()
+
+
+@shared_task
+def process_image_task(file_id):
+    file = File.objects.filter(pk=file_id, status=FileStatusEnum.processing).first()
+    if not file:
+        return
+    try:
+        fields = process_image(file)
+    except Exception as e:
+        logger.exception(f'Image processing of file {file_id} failed: {e.args};')
+        file_references(file).update(status=FileStatusEnum.failed)
+        return
+    # duplicate uploads made while processing reference the same object and get the same variants
+    file_references(file).update(**fields, status=FileStatusEnum.ready)
+
+
+@shared_task
+def cleanup_upload_sessions_task():
+    return {'sessions': cleanup_upload_sessions(), 'direct_uploads': cleanup_direct_uploads()}
+
+
+@shared_task(soft_time_limit=time_limit())
+def transcode_media_task(file_id):
+    file = File.objects.filter(pk=file_id, status=FileStatusEnum.processing).first()
+    if not file:
+        return
+    try:
+        variants = build_media_variants(file)
+    except Exception as e:
+        logger.exception(f'Transcoding of file {file_id} failed: {e.args};')
+        file_references(file).update(status=FileStatusEnum.failed)
+        return
+    file_references(file).update(variants=variants, status=FileStatusEnum.ready)
+
+
+@shared_task
+def collect_orphaned_files_task():
+    return collect_orphaned_files()
@@ -1,3 +1,132 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from apps.authentication.models import User, SubscriptionPlan
+from apps.chat.models import ChatRoom, Message, Broadcast, ArchivedMessageChunk
+from apps.content.models import Category, Post, PostTypes
+from apps.files.models import File, FileStatusEnum
+from apps.files.orphans import WEAK_FILE_REFERENCES, collect_orphaned_files
+from apps.files.utils import create_duplicate, delete_file, find_duplicate, upload_path
+
+
+def deleted_keys(delete_objects):
+    return [key for call in delete_objects.call_args_list for key in call.args[0]]
+
+
+class OrphanedFilesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(phone_number='998900000101', username='gc_user')
+        partner = User.objects.create_user(phone_number='998900000102', username='gc_partner')
+        self.room = ChatRoom.objects.create(creator=self.user, subscriber=partner)
+
+    @staticmethod
+    def create_file(gen_name, sha256=None):
+        """File created before the grace period, i.e. a candidate for collection"""
+        file = File.objects.create(name=gen_name, gen_name=gen_name, size=10, sha256=sha256)
+        File.objects.filter(pk=file.pk).update(created_at=timezone.now() - timedelta(days=30))
+        return file
+
+    def reference_builders(self):
+        """Creates a row referencing the file, one per (model label, field name) of a relation to File"""
+        def set_user_field(field):
+            return lambda file: User.objects.filter(pk=self.user.pk).update(**{field: file})
+
+        return {
+            ('authentication.user', 'donation_banner'): set_user_field('donation_banner'),
+            ('authentication.user', 'profile_photo'): set_user_field('profile_photo'),
+            ('authentication.user', 'profile_banner_photo'): set_user_field('profile_banner_photo'),
+            ('authentication.subscriptionplan', 'banner'):
+                lambda file: SubscriptionPlan.objects.create(name='plan', price=1000, creator=self.user, banner=file),
+            ('content.category', 'icon'): lambda file: Category.objects.create(name='category', icon=file),
+            ('content.post', 'files'):
+                lambda file: Post.objects.create(user=self.user, post_type=PostTypes.file).files.add(file),
+            ('chat.message', 'file'): lambda file: Message.objects.create(room=self.room, sender=self.user, file=file),
+            ('chat.broadcast', 'file'): lambda file: Broadcast.objects.create(creator=self.user, file=file),
+        }
+
+    def collect(self, **kwargs):
+        with mock.patch('apps.files.orphans.delete_objects') as delete_objects:
+            with self.captureOnCommitCallbacks(execute=True):
+                report = collect_orphaned_files(**kwargs)
+        return report, delete_objects
+
+    def test_referenced_files_survive(self):
+        builders = self.reference_builders()
+        referenced = []
+        for relation in File._meta.related_objects:
+            label = (relation.related_model._meta.label_lower, relation.field.name)
+            if label in WEAK_FILE_REFERENCES:
+                continue
+            # a new relation to File has to be added to reference_builders
+            self.assertIn(label, builders)
+            file = self.create_file(f'{label[0]}.{label[1]}.bin')
+            builders[label](file)
+            referenced.append(file.pk)
+
+        archived = self.create_file('archived.bin')
+        ArchivedMessageChunk.objects.create(room=self.room, partition='chat_message_p2020_01', key='archive',
+                                            min_id=1, max_id=1, count=1, file_ids=[archived.pk])
+        referenced.append(archived.pk)
+        orphan = self.create_file('orphan.bin')
+
+        report, delete_objects = self.collect()
+
+        self.assertEqual(set(File.objects.filter(pk__in=referenced).values_list('pk', flat=True)), set(referenced))
+        self.assertFalse(File.objects.filter(pk=orphan.pk).exists())
+        self.assertEqual(report['files_deleted'], 1)
+        self.assertEqual(deleted_keys(delete_objects), [upload_path('orphan.bin')])
+
+    def test_object_shared_with_a_live_duplicate_is_kept(self):
+        live = self.create_file('shared.bin', sha256='a' * 64)
+        Message.objects.create(room=self.room, sender=self.user, file=live)
+        orphan = self.create_file('shared.bin', sha256='a' * 64)
+
+        report, delete_objects = self.collect()
+
+        self.assertFalse(File.objects.filter(pk=orphan.pk).exists())
+        self.assertTrue(File.objects.filter(pk=live.pk).exists())
+        self.assertEqual(report['objects_deleted'], 0)
+        self.assertNotIn(upload_path('shared.bin'), deleted_keys(delete_objects))
+
+    def test_dry_run_deletes_nothing(self):
+        orphan = self.create_file('orphan.bin')
+
+        report, delete_objects = self.collect(dry_run=True)
+
+        self.assertEqual(report, {'files': 1, 'bytes': 10})
+        self.assertTrue(File.objects.filter(pk=orphan.pk).exists())
+        delete_objects.assert_not_called()
+
+
+class DuplicateFilesTests(TestCase):
+    @staticmethod
+    def create_file(gen_name, sha256='b' * 64, **fields):
+        return File.objects.create(name=gen_name, gen_name=gen_name, size=10, sha256=sha256, **fields)
+
+    def test_find_duplicate_returns_the_oldest_usable_file(self):
+        self.create_file('failed.bin', status=FileStatusEnum.failed)
+        original = self.create_file('original.bin')
+        self.create_file('copy.bin')
+
+        self.assertEqual(find_duplicate('b' * 64, 10), original)
+        self.assertIsNone(find_duplicate('b' * 64, 11))
+        self.assertIsNone(find_duplicate('c' * 64, 10))
+
+    def test_deleting_a_duplicate_keeps_the_shared_object(self):
+        variants = {'thumbnail': {'gen_name': 'shared_thumbnail.jpg'}}
+        original = self.create_file('shared.jpg', variants=variants)
+        duplicate = create_duplicate(original, 'copy.jpg')
+
+        with mock.patch('apps.files.utils.delete_objects') as delete_objects:
+            with self.captureOnCommitCallbacks(execute=True):
+                delete_file(duplicate)
+        self.assertFalse(File.objects.filter(pk=duplicate.pk).exists())
+        delete_objects.assert_not_called()
 
-# Create your tests here.
+        with mock.patch('apps.files.utils.delete_objects') as delete_objects:
+            with self.captureOnCommitCallbacks(execute=True):
+                delete_file(original)
+        delete_objects.assert_called_once_with([upload_path('shared.jpg'), upload_path('shared_thumbnail.jpg')])
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.files.models import File, FileStatusEnum
+from apps.files.utils import file_references, media_path, upload_path
+from config.core.minio import s3_client, s3_transfer_config
+
+logger = logging.getLogger()
+
+HLS_PLAYLIST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+HLS_CONTENT_TYPES = {'.m3u8': HLS_PLAYLIST_CONTENT_TYPE, '.ts': 'video/mp2t'}
+# ffmpeg output options, extension and content type of the music renditions
+AUDIO_OUTPUTS = {
+    'opus': (['-c:a', 'libopus'], 'opus', 'audio/ogg'),
+    'aac': (['-c:a', 'aac', '-movflags', '+faststart'], 'm4a', 'audio/mp4'),
+}
+
+
+def time_limit() -> int:
+    """Every rendition may take TIMEOUT seconds, one more TIMEOUT covers the download, probe and uploads"""
+    runs = max(len(settings.MEDIA_TRANSCODING['VIDEO_RENDITIONS']), len(AUDIO_OUTPUTS))
+    return settings.MEDIA_TRANSCODING['TIMEOUT'] * (runs + 1)
+
+
+def is_transcodable(content_type) -> bool:
+    return bool(content_type) and content_type.startswith(('video/', 'audio/'))
+
+
+def bitrate_bps(bitrate) -> int:
+    return int(bitrate[:-1]) * 1000 if bitrate.endswith('k') else int(bitrate)
+
+
+def input_options() -> list:
+    """
+    Options placed before every -i: uploads are untrusted, a playlist or concat file would make ffmpeg
+    read local files or fetch URLs, so only the file protocol and the container demuxers are allowed
+    """
+    return ['-protocol_whitelist', 'file', '-format_whitelist', ','.join(settings.MEDIA_TRANSCODING['FORMATS'])]
+
+
+def run_ffmpeg(*args):
+    subprocess.run(
+        [settings.MEDIA_TRANSCODING['FFMPEG'], '-hide_banner', '-loglevel', 'error', '-y', *args],
+        check=True, capture_output=True, timeout=settings.MEDIA_TRANSCODING['TIMEOUT'],
+    )
+
+
+def probe(path) -> dict:
+    result = subprocess.run(
+        [settings.MEDIA_TRANSCODING['FFPROBE'], '-v', 'error', *input_options(), '-print_format', 'json',
+         '-show_format', '-show_streams', path],
+        check=True, capture_output=True, timeout=60,
+    )
+    info = json.loads(result.stdout)
+    # demuxer names may list aliases, e.g. "mov,mp4,m4a,3gp,3g2,mj2"
+    format_names = set(info.get('format', {}).get('format_name', '').split(','))
+    if not format_names & set(settings.MEDIA_TRANSCODING['FORMATS']):
+        raise ValueError(f'Unsupported container: {info.get("format", {}).get("format_name")}')
+    return info
+
+
+def display_size(stream):
+    """Width and height as played, phones record portrait video as rotated landscape"""
+    rotation = stream.get('tags', {}).get('rotate') or next(
+        (data['rotation'] for data in stream.get('side_data_list', []) if 'rotation' in data), 0)
+    width, height = int(stream['width']), int(stream['height'])
+    if abs(int(rotation)) % 180 == 90:
+        return height, width
+    return width, height
+
+
+def upload_output(local_path, gen_name, content_type) -> int:
+    s3_client.upload_file(
+        local_path,
+        settings.AWS_STORAGE_BUCKET_NAME,
+        upload_path(gen_name),
+        ExtraArgs={'ContentType': content_type},
+        Config=s3_transfer_config,
+    )
+    return os.path.getsize(local_path)
+
+
+def transcode_video(source, workdir, stem, video, has_audio) -> dict:
+    """
+    Encodes every rendition not larger than the source into HLS segments, writes a master playlist over them
+    and uploads the tree under uploads/<stem>_hls/
+    """
+    source_width, source_height = display_size(video)
+    # rendition heights apply to the shorter side, a 1080p portrait video is 1080 pixels wide
+    short_side = min(source_width, source_height)
+    segment_duration = settings.MEDIA_TRANSCODING['HLS_SEGMENT_DURATION']
+    renditions = [rendition for rendition in settings.MEDIA_TRANSCODING['VIDEO_RENDITIONS']
+                  if rendition['height'] <= short_side] or settings.MEDIA_TRANSCODING['VIDEO_RENDITIONS'][:1]
+
+    hls_dir = os.path.join(workdir, 'hls')
+    master = ['#EXTM3U', '#EXT-X-VERSION:3']
+    width, height = 0, 0
+    for rendition in renditions:
+        scale = min(rendition['height'], short_side) / short_side
+        width, height = round(source_width * scale / 2) * 2, round(source_height * scale / 2) * 2
+        output_dir = os.path.join(hls_dir, rendition['name'])
+        os.makedirs(output_dir)
+
+        args = [*input_options(), '-i', source, '-map', '0:v:0']
+        if has_audio:
+            args += ['-map', '0:a:0', '-c:a', 'aac', '-ac', '2', '-b:a', rendition['audio_bitrate']]
+        video_bitrate = bitrate_bps(rendition['video_bitrate'])
+        run_ffmpeg(
+            *args,
+            '-vf', f'scale={width}:{height}', '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+            '-b:v', str(video_bitrate), '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2),
+            # a key frame at every segment boundary, so that players can switch renditions there
+            '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration})', '-sc_threshold', '0',
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+            '-hls_segment_filename', os.path.join(output_dir, '%05d.ts'),
+            os.path.join(output_dir, 'index.m3u8'),
+        )
+        bandwidth = video_bitrate + (bitrate_bps(rendition['audio_bitrate']) if has_audio else 0)
+        master += [f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}',
+                   f'{rendition["name"]}/index.m3u8']
+
+    with open(os.path.join(hls_dir, 'master.m3u8'), 'w') as playlist:
+        playlist.write('\n'.join(master) + '\n')
+
+    # outputs are uploaded only after every rendition has been encoded
+    prefix = f'{stem}_hls'
+    files, size = [], 0
+    for root, _, names in os.walk(hls_dir):
+        for name in sorted(names):
+            local_path = os.path.join(root, name)
+            gen_name = f'{prefix}/{os.path.relpath(local_path, hls_dir)}'
+            size += upload_output(local_path, gen_name, HLS_CONTENT_TYPES[os.path.splitext(name)[1]])
+            files.append(gen_name)
+    return {
+        'hls': {
+            'gen_name': f'{prefix}/master.m3u8',
+            'path': media_path(f'{prefix}/master.m3u8'),
+            'size': size,
+            'content_type': HLS_PLAYLIST_CONTENT_TYPE,
+            'width': width,
+            'height': height,
+            # every playlist and segment, deleted together with the file
+            'files': files,
+        }
+    }
+
+
+def transcode_audio(source, workdir, stem) -> dict:
+    outputs = []
+    for variant, (codec_args, extension, content_type) in AUDIO_OUTPUTS.items():
+        local_path = os.path.join(workdir, f'{variant}.{extension}')
+        run_ffmpeg(*input_options(), '-i', source, '-map', '0:a:0', '-vn', *codec_args,
+                   '-b:a', settings.MEDIA_TRANSCODING['AUDIO_BITRATES'][variant], local_path)
+        outputs.append((variant, local_path, f'{stem}_{variant}.{extension}', content_type))
+
+    variants = {}
+    for variant, local_path, gen_name, content_type in outputs:
+        variants[variant] = {
+            'gen_name': gen_name,
+            'path': media_path(gen_name),
+            'size': upload_output(local_path, gen_name, content_type),
+            'content_type': content_type,
+        }
+    return variants
+
+
+def build_media_variants(file: File) -> dict:
+    """Downloads the original to a temporary directory and transcodes it by the streams it contains"""
+    with tempfile.TemporaryDirectory(dir=settings.MEDIA_TRANSCODING['TEMP_DIR']) as workdir:
+        source = os.path.join(workdir, 'source')
+        s3_client.download_file(settings.AWS_STORAGE_BUCKET_NAME, upload_path(file.gen_name), source,
+                                Config=s3_transfer_config)
+        streams = probe(source)['streams']
+        # cover art of music files is reported as a video stream
+        video = next((stream for stream in streams if stream['codec_type'] == 'video'
+                      and not stream.get('disposition', {}).get('attached_pic')), None)
+        has_audio = any(stream['codec_type'] == 'audio' for stream in streams)
+        stem = file.gen_name.rsplit('.', 1)[0]
+        if video:
+            return transcode_video(source, workdir, stem, video, has_audio)
+        if has_audio:
+            return transcode_audio(source, workdir, stem)
+        raise ValueError('No audio or video streams')
+
+
+def queue_transcoding(files):
+    """Marks video and audio files that were not transcoded yet as processing and transcodes them after commit"""
+    from apps.files.tasks import transcode_media_task
+
+    for file in files:
+        if not is_transcodable(file.content_type) or file.variants:
+            continue
+        if File.objects.filter(pk=file.pk, status=FileStatusEnum.ready).update(status=FileStatusEnum.processing):
+            file_references(file).update(status=FileStatusEnum.processing)
+            transaction.on_commit(partial(transcode_media_task.delay, file.id))
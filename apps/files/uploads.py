@@ -0,0 +1,308 @@
+import base64
+import hashlib
+import logging
+import math
+import mimetypes
+from datetime import timedelta
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core import signing
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+
+from apps.files.models import File, UploadSession, UploadSessionPart, UploadSessionStatusEnum
+from apps.files.utils import (create_file, create_duplicate, find_duplicate, gen_hash_name, upload_path,
+                              delete_objects)
+from config.core.api_exceptions import APICodeValidation
+from config.core.minio import s3_client, public_s3_client
+
+logger = logging.getLogger()
+
+
+def chunks_count(session: UploadSession) -> int:
+    return math.ceil(session.size / session.chunk_size)
+
+
+def expected_chunk_size(session: UploadSession, number: int) -> int:
+    """Every chunk is chunk_size bytes long except the last one"""
+    return min(session.chunk_size, session.size - (number - 1) * session.chunk_size)
+
+
+def missing_offsets(session: UploadSession) -> list:
+    received = set(session.parts.values_list('number', flat=True))
+    return [(number - 1) * session.chunk_size for number in range(1, chunks_count(session) + 1)
+            if number not in received]
+
+
+def create_upload_session(name, size, content_type=None, checksum=None) -> UploadSession:
+    gen_name = gen_hash_name(name)
+    content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    response = s3_client.create_multipart_upload(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=upload_path(gen_name),
+        ContentType=content_type,
+    )
+    return UploadSession.objects.create(
+        name=name,
+        gen_name=gen_name,
+        content_type=content_type,
+        size=size,
+        chunk_size=settings.FILE_UPLOAD_SESSION['CHUNK_SIZE'],
+        checksum=checksum,
+        upload_id=response['UploadId'],
+        expires_at=timezone.now() + timedelta(seconds=settings.FILE_UPLOAD_SESSION['TTL']),
+    )
+
+
+def check_session_is_active(session: UploadSession):
+    if session.status != UploadSessionStatusEnum.active or session.expires_at <= timezone.now():
+        raise APICodeValidation(_('Сессия загрузки завершена или истекла'), code='upload_session_closed',
+                                status_code=status.HTTP_409_CONFLICT)
+
+
+def upload_chunk(session: UploadSession, offset: int, data: bytes, checksum=None) -> UploadSessionPart:
+    """
+    Stores the chunk starting at offset as the matching multipart part;
+    sending a chunk again replaces the previous attempt
+    """
+    check_session_is_active(session)
+    if offset < 0 or offset >= session.size or offset % session.chunk_size:
+        raise APICodeValidation(_('Неверное смещение части файла'), code='invalid_offset')
+    number = offset // session.chunk_size + 1
+    if len(data) != expected_chunk_size(session, number):
+        raise APICodeValidation(_('Неверный размер части файла'), code='invalid_chunk_size')
+
+    digest = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise APICodeValidation(_('Контрольная сумма части файла не совпадает'), code='checksum_mismatch')
+
+    response = s3_client.upload_part(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=upload_path(session.gen_name),
+        UploadId=session.upload_id,
+        PartNumber=number,
+        Body=data,
+        # MinIO rejects the part if it was corrupted between Django and the storage
+        ContentMD5=base64.b64encode(hashlib.md5(data).digest()).decode(),
+    )
+    part, _created = UploadSessionPart.objects.update_or_create(
+        session=session, number=number,
+        defaults={'size': len(data), 'etag': response['ETag'], 'checksum': digest},
+    )
+    return part
+
+
+def object_checksum(key) -> str:
+    obj = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=key)
+    digest = hashlib.sha256()
+    for chunk in obj['Body'].iter_chunks(settings.AWS_S3_MULTIPART_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def complete_upload_session(session: UploadSession):
+    check_session_is_active(session)
+    parts = list(session.parts.order_by('number').values_list('number', 'etag'))
+    if len(parts) != chunks_count(session):
+        raise APICodeValidation(_('Файл загружен не полностью'), code='upload_incomplete')
+
+    # only one completion request may assemble the object
+    is_claimed = UploadSession.objects.filter(
+        pk=session.pk, status=UploadSessionStatusEnum.active
+    ).update(status=UploadSessionStatusEnum.completing)
+    if not is_claimed:
+        raise APICodeValidation(_('Сессия загрузки завершена или истекла'), code='upload_session_closed',
+                                status_code=status.HTTP_409_CONFLICT)
+
+    key = upload_path(session.gen_name)
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=key,
+            UploadId=session.upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag} for number, etag in parts]},
+        )
+    except Exception:
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSessionStatusEnum.active)
+        raise
+
+    try:
+        duplicate = save_session_file(session, key)
+    except Exception:
+        # the parts are gone, the session can not be completed again; the assembled object has no File row,
+        # it would stay public and never be collected
+        UploadSession.objects.filter(pk=session.pk).update(status=UploadSessionStatusEnum.failed)
+        delete_session_object(session)
+        raise
+    if duplicate:
+        # the assembled object is not referenced by any row
+        delete_session_object(session)
+    session.parts.all().delete()
+    return session.file
+
+
+def save_session_file(session: UploadSession, key):
+    """Verifies the assembled object and creates the File of the session, returns the reused duplicate if any"""
+    # S3 ETags of multipart objects are not content hashes, the assembled object is read back once;
+    # only this hash is trusted for deduplication, sessions without a declared checksum are not deduplicated
+    sha256 = None
+    if session.checksum:
+        sha256 = object_checksum(key)
+        if sha256 != session.checksum.lower():
+            raise APICodeValidation(_('Контрольная сумма файла не совпадает'), code='checksum_mismatch')
+
+    with transaction.atomic():
+        duplicate = sha256 and find_duplicate(sha256, session.size)
+        if duplicate:
+            session.file = create_duplicate(duplicate, session.name)
+        else:
+            session.file = create_file(session.name, session.size, session.gen_name, session.content_type,
+                                       sha256=sha256)
+        session.status = UploadSessionStatusEnum.completed
+        session.save(update_fields=['file', 'status', 'updated_at'])
+    return duplicate
+
+
+def delete_session_object(session: UploadSession):
+    try:
+        s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=upload_path(session.gen_name))
+    except Exception as e:
+        # cleanup_upload_sessions deletes it again once the session expires
+        logger.exception(f'Upload session {session.pk} object was not deleted: {e.args};')
+
+
+def abort_multipart_upload(session: UploadSession):
+    try:
+        s3_client.abort_multipart_upload(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=upload_path(session.gen_name),
+            UploadId=session.upload_id,
+        )
+    except ClientError as e:
+        # already completed or aborted
+        if e.response['Error']['Code'] != 'NoSuchUpload':
+            raise
+
+
+def cleanup_upload_sessions() -> int:
+    """
+    Aborts multipart uploads of expired sessions and deletes the sessions, returns the count;
+    an object assembled by a session that did not complete has no File row and is deleted as well
+    """
+    deleted = 0
+    batch_size = settings.FILE_UPLOAD_SESSION['CLEANUP_BATCH_SIZE']
+    while True:
+        sessions = list(
+            UploadSession.objects.filter(expires_at__lte=timezone.now()).order_by('expires_at')[:batch_size]
+        )
+        if not sessions:
+            break
+        for session in sessions:
+            if session.status != UploadSessionStatusEnum.completed:
+                abort_multipart_upload(session)
+                s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=upload_path(session.gen_name))
+        UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+        deleted += len(sessions)
+    if deleted:
+        logger.info(f'Upload sessions cleaned up: {deleted};')
+    return deleted
+
+
+DIRECT_UPLOAD_SALT = 'files.direct_upload'
+
+
+def staging_path(file_name) -> str:
+    return f'{settings.FILE_DIRECT_UPLOAD_STAGING_PREFIX}{file_name}'
+
+
+def presign_direct_upload(name, size, content_type=None) -> dict:
+    """
+    Lets the client send the file straight to MinIO with a presigned POST (size and content type are
+    enforced by the policy) or PUT; the object goes to the staging prefix, which is not served, and the
+    returned token is exchanged for a File by complete_direct_upload
+    """
+    gen_name = gen_hash_name(name)
+    key = staging_path(gen_name)
+    content_type = content_type or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    expires = settings.FILE_DIRECT_UPLOAD_EXPIRES
+    post = public_s3_client.generate_presigned_post(
+        Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+        Key=key,
+        Fields={'Content-Type': content_type},
+        Conditions=[{'Content-Type': content_type}, ['content-length-range', size, size]],
+        ExpiresIn=expires,
+    )
+    put_url = public_s3_client.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key,
+                'ContentType': content_type, 'ContentLength': size},
+        ExpiresIn=expires,
+    )
+    token = signing.dumps({'name': name, 'gen_name': gen_name, 'size': size, 'content_type': content_type},
+                          salt=DIRECT_UPLOAD_SALT)
+    return {
+        'token': token,
+        'expires_in': expires,
+        'post': post,
+        'put': {'url': put_url, 'headers': {'Content-Type': content_type, 'Content-Length': str(size)}},
+    }
+
+
+def complete_direct_upload(token) -> File:
+    try:
+        upload = signing.loads(token, salt=DIRECT_UPLOAD_SALT, max_age=settings.FILE_DIRECT_UPLOAD_EXPIRES * 2)
+    except signing.BadSignature:
+        raise APICodeValidation(_('Неверный или просроченный токен загрузки'), code='invalid_upload_token')
+
+    bucket = settings.AWS_STORAGE_BUCKET_NAME
+    key = staging_path(upload['gen_name'])
+    with transaction.atomic():
+        # concurrent completions of one token wait for each other, completing twice returns the same file;
+        # gen_name is not unique, duplicate uploads share it, so the token is locked instead
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [upload['gen_name']])
+        file = File.objects.filter(gen_name=upload['gen_name']).order_by('pk').first()
+        if file:
+            return file
+
+        try:
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise APICodeValidation(_('Файл не был загружен'), code='upload_not_found')
+            raise
+        # the token only proves what was requested, the stored object itself is checked
+        if head['ContentLength'] != upload['size'] or head.get('ContentType') != upload['content_type']:
+            s3_client.delete_object(Bucket=bucket, Key=key)
+            raise APICodeValidation(_('Загруженный файл не совпадает с заявленным'), code='upload_mismatch')
+
+        # only completed uploads become public under uploads/
+        s3_client.copy_object(Bucket=bucket, Key=upload_path(upload['gen_name']),
+                              CopySource={'Bucket': bucket, 'Key': key})
+        try:
+            file = create_file(upload['name'], upload['size'], upload['gen_name'], upload['content_type'])
+        except Exception:
+            s3_client.delete_object(Bucket=bucket, Key=upload_path(upload['gen_name']))
+            raise
+        transaction.on_commit(lambda: s3_client.delete_object(Bucket=bucket, Key=key))
+        return file
+
+
+def cleanup_direct_uploads() -> int:
+    """Deletes staged objects whose token has expired, i.e. uploads that were never completed; returns the count"""
+    expired_at = timezone.now() - timedelta(seconds=settings.FILE_DIRECT_UPLOAD_EXPIRES * 2)
+    paginator = s3_client.get_paginator('list_objects_v2')
+    keys = [
+        item['Key']
+        for page in paginator.paginate(Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+                                       Prefix=settings.FILE_DIRECT_UPLOAD_STAGING_PREFIX)
+        for item in page.get('Contents', [])
+        if item['LastModified'] <= expired_at
+    ]
+    delete_objects(keys)
+    if keys:
+        logger.info(f'Stale direct uploads cleaned up: {len(keys)};')
+    return len(keys)
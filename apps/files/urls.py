@@ -1,9 +1,15 @@
 from django.urls import path
 
-from apps.files.views import FileCreateAPIView, FileDeleteAPIView
+from apps.files.views import (FileCreateAPIView, FileDeleteAPIView, UploadSessionCreateAPIView, UploadSessionAPIView,
+                              UploadSessionCompleteAPIView, DirectUploadAPIView, DirectUploadCompleteAPIView)
 
 app_name = 'files'
 urlpatterns = [
     path('create/', FileCreateAPIView.as_view(), name='file_create'),
     path('delete/<int:pk>/', FileDeleteAPIView.as_view(), name='file_delete'),
+    path('uploads/', UploadSessionCreateAPIView.as_view(), name='upload_session_create'),
+    path('uploads/<uuid:pk>/', UploadSessionAPIView.as_view(), name='upload_session'),
+    path('uploads/<uuid:pk>/complete/', UploadSessionCompleteAPIView.as_view(), name='upload_session_complete'),
+    path('direct-uploads/', DirectUploadAPIView.as_view(), name='direct_upload'),
+    path('direct-uploads/complete/', DirectUploadCompleteAPIView.as_view(), name='direct_upload_complete'),
 ]
@@ -1,22 +1,22 @@
+import hashlib
 import io
 import logging
 import mimetypes
-import sys
 import time
 import uuid
 from os import sep
 from os.path import join as join_path
 
-from PIL import Image
+import blurhash
+from PIL import Image, ImageOps
 from django.conf import settings
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.db import transaction
 from dotenv import load_dotenv
 from rest_framework import status
 
-from apps.files.models import File
+from apps.files.models import File, FileStatusEnum
 from config.core.api_exceptions import APIValidation
-from config.core.minio import s3_client
+from config.core.minio import s3_client, s3_transfer_config
 
 load_dotenv()
 logger = logging.getLogger()
@@ -46,79 +46,233 @@ def gen_hash_name(filename) -> str:
     return "%s.%s" % (unique_code(), get_extension(filename=filename))
 
 
-def compress_image(file, quality=50):
+# responsive versions of uploaded images, max_size bounds the longer side
+IMAGE_VARIANTS = {
+    'compressed': {'max_size': None, 'format': 'JPEG', 'quality': 50},
+    'thumbnail': {'max_size': 320, 'format': 'JPEG', 'quality': 70},
+    'medium': {'max_size': 1280, 'format': 'JPEG', 'quality': 75},
+    'webp': {'max_size': 1280, 'format': 'WEBP', 'quality': 75},
+}
+IMAGE_VARIANT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+# longer side of the copy the blurhash is computed from, the placeholder is blurred anyway
+BLURHASH_SIZE = 32
+
+
+def is_processable_image(content_type) -> bool:
+    return bool(content_type) and content_type.startswith('image/') and content_type != 'image/svg+xml'
+
+
+def render_image_variant(image, max_size=None, format='JPEG', quality=50) -> bytes:
     """
-    Compress uploaded image using Pillow before saving.
-    Converts all formats to JPEG for better compression.
+    Resizes a copy of the image to fit max_size and encodes it.
+    JPEG drops transparency, so RGBA and palette images are converted to RGB
     """
-    try:
-        image = Image.open(file)
-        image_io = io.BytesIO()
-
-        # Convert to RGB (to avoid issues with PNG/transparency)
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-
-        image.save(image_io, format='JPEG', quality=quality, optimize=True)
-        image_io.seek(0)
-
-        compressed = InMemoryUploadedFile(
-            image_io,
-            field_name='file',
-            name=f"{file.name.rsplit('.', 1)[0]}.jpg",
-            content_type='image/jpeg',
-            size=sys.getsizeof(image_io),
-            charset=None
+    image = image.copy()
+    if max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    if format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    image_io = io.BytesIO()
+    image.save(image_io, format=format, quality=quality, optimize=True)
+    return image_io.getvalue()
+
+
+def load_image(file: File):
+    obj = s3_client.get_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=upload_path(file.gen_name))
+    image = Image.open(io.BytesIO(obj['Body'].read()))
+    # phones store rotation in EXIF, the variants are written without it
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def image_blurhash(image) -> str:
+    """Blurhash of a downscaled copy, a short string clients decode into a blurred preview"""
+    small = image.convert('RGB')
+    small.thumbnail((BLURHASH_SIZE, BLURHASH_SIZE))
+    width, height = small.size
+    pixels = list(small.getdata())
+    rows = [pixels[y * width:(y + 1) * width] for y in range(height)]
+    components_x, components_y = (4, 3) if width >= height else (3, 4)
+    return blurhash.encode(rows, components_x, components_y)
+
+
+def process_image(file: File) -> dict:
+    """Builds the variants, intrinsic size and placeholder of an image, returns the File fields to update"""
+    image = load_image(file)
+    return {
+        'variants': build_image_variants(file, image),
+        'width': image.width,
+        'height': image.height,
+        'blurhash': image_blurhash(image),
+    }
+
+
+def build_image_variants(file: File, image) -> dict:
+    """Uploads every IMAGE_VARIANTS entry next to the original and returns their descriptions"""
+    stem = file.gen_name.rsplit('.', 1)[0]
+    variants = {}
+    for variant, options in IMAGE_VARIANTS.items():
+        data = render_image_variant(image, **options)
+        gen_name = f'{stem}_{variant}.{IMAGE_VARIANT_EXTENSIONS[options["format"]]}'
+        content_type = f'image/{options["format"].lower()}'
+        s3_client.put_object(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Key=upload_path(gen_name),
+            Body=data,
+            ContentType=content_type,
         )
-        return compressed
-    except Exception as e:
-        logger.warning(f'Image compression failed: {e}')
-        return file  # fallback to original if something goes wrong
+        width, height = Image.open(io.BytesIO(data)).size
+        variants[variant] = {
+            'gen_name': gen_name,
+            'path': media_path(gen_name),
+            'size': len(data),
+            'content_type': content_type,
+            'width': width,
+            'height': height,
+        }
+    return variants
+
+
+def file_sha256(file) -> str:
+    """Hashes an uploaded file chunk by chunk and rewinds it for the upload"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def file_references(file: File):
+    """Rows sharing the stored object of file, looked up by the indexed hash"""
+    if not file.sha256:
+        return File.objects.filter(pk=file.pk)
+    return File.objects.filter(sha256=file.sha256, gen_name=file.gen_name)
+
+
+def find_duplicate(sha256, size):
+    """
+    The oldest File with the same content, must be called in a transaction:
+    the row stays locked, so delete_file can not remove the object before the new reference is saved
+    """
+    return (File.objects.select_for_update()
+            .filter(sha256=sha256, size=size)
+            .exclude(status=FileStatusEnum.failed)
+            .order_by('id')
+            .first())
+
+
+def create_duplicate(original: File, name) -> File:
+    """New File row referencing the stored object and variants of original"""
+    logger.info(f'Duplicate upload of file {original.id} reused;')
+    file = File.objects.create(name=name,
+                               size=original.size,
+                               gen_name=original.gen_name,
+                               path=original.path,
+                               content_type=original.content_type,
+                               extension=get_extension(filename=name),
+                               status=original.status,
+                               variants=original.variants,
+                               width=original.width,
+                               height=original.height,
+                               blurhash=original.blurhash,
+                               sha256=original.sha256)
+    if file.status == FileStatusEnum.processing:
+        # the variant keys derive from gen_name, whichever task runs first finishes every reference
+        from apps.files.tasks import process_image_task, transcode_media_task
+
+        task = process_image_task if is_processable_image(file.content_type) else transcode_media_task
+        transaction.on_commit(lambda: task.delay(file.id))
+    return file
+
+
+def create_file(name, size, gen_name, content_type, sha256=None) -> File:
+    """
+    Saves the File row of an object already stored under uploads/;
+    images are left in `processing` state until process_image_task builds their variants
+    """
+    is_image = is_processable_image(content_type)
+    file = File.objects.create(name=name,
+                               size=size,
+                               gen_name=gen_name,
+                               path=media_path(gen_name),
+                               content_type=content_type,
+                               extension=get_extension(filename=name),
+                               status=FileStatusEnum.processing if is_image else FileStatusEnum.ready,
+                               sha256=sha256)
+    if is_image:
+        from apps.files.tasks import process_image_task
+
+        transaction.on_commit(lambda: process_image_task.delay(file.id))
+    return file
 
 
 def upload_file(file):
+    """
+    Stores the original as is and returns quickly, see create_file;
+    content that is already stored is not uploaded again, the new row references the existing object
+    """
     try:
+        name = file.name
+        size = file.size
+        sha256 = file_sha256(file)
         with transaction.atomic():
-            if hasattr(file, 'content_type') and 'image' in file.content_type:
-                file = compress_image(file)
-
-            name = file.name
-            size = file.size
-            gen_name = gen_new_name(file)
-            extra_content_type, encoding = mimetypes.guess_type(file.name)
-            content_type = file.content_type if hasattr(file, 'content_type') else extra_content_type
-            extension = get_extension(filename=file.name)
-            path = media_path(gen_name)
-            s3_path = upload_path(gen_name)
-
-            s3_client.upload_fileobj(
-                file,
-                settings.AWS_STORAGE_BUCKET_NAME,
-                s3_path,
-                ExtraArgs={
-                    'ContentType': content_type,
-                    # 'ACL': 'private' # or whatever ACL you need
-                }
-            )
-
-            uploaded_file = File(name=name,
-                                 size=size,
-                                 gen_name=gen_name,
-                                 path=path,
-                                 content_type=content_type,
-                                 extension=extension)
-            # with open(join_path('media', 'uploads', gen_name.replace(sep, '/')), 'wb+') as destination:
-            #     for chunk in file.chunks():
-            #         destination.write(chunk)
-            uploaded_file.save()
-
-            return uploaded_file
+            duplicate = find_duplicate(sha256, size)
+            if duplicate:
+                return create_duplicate(duplicate, name)
+
+        gen_name = gen_new_name(file)
+        extra_content_type, encoding = mimetypes.guess_type(file.name)
+        content_type = file.content_type if hasattr(file, 'content_type') else extra_content_type
+        s3_path = upload_path(gen_name)
+
+        s3_client.upload_fileobj(
+            file,
+            settings.AWS_STORAGE_BUCKET_NAME,
+            s3_path,
+            ExtraArgs={
+                'ContentType': content_type,
+                # 'ACL': 'private' # or whatever ACL you need
+            },
+            Config=s3_transfer_config,
+        )
+
+        # with open(join_path('media', 'uploads', gen_name.replace(sep, '/')), 'wb+') as destination:
+        #     for chunk in file.chunks():
+        #         destination.write(chunk)
+        uploaded_file = create_file(name, size, gen_name, content_type, sha256=sha256)
     except Exception as exc:
         logger.debug(f'file_upload_failed: {exc.__doc__}')
         raise APIValidation(detail=f"{exc.__doc__} - {exc.args}", status_code=status.HTTP_400_BAD_REQUEST)
+    return uploaded_file
 
 
 def delete_file(file: File):
-    # file = s3_client.head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=f'uploads/{file.gen_name}')
-    # print(file)
-    return s3_client.delete_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME, Key=f'uploads/{file.gen_name}')
+    """
+    Deletes the File row; the stored object and its variants are removed
+    only when no other File references them (duplicate uploads share one object)
+    """
+    with transaction.atomic():
+        # locks every reference, a concurrent upload can not reuse the object while it is being removed
+        references = file_references(file).select_for_update().values_list('pk', flat=True)
+        is_referenced = any(pk != file.pk for pk in references)
+        file.delete()
+        if is_referenced:
+            return
+
+        keys = [upload_path(file.gen_name)]
+        for variant in (file.variants or {}).values():
+            # HLS variants list their playlists and segments in `files`
+            keys += [upload_path(gen_name) for gen_name in variant.get('files', [variant['gen_name']])]
+        transaction.on_commit(lambda: delete_objects(keys))
+
+
+def delete_objects(keys):
+    """delete_objects accepts at most 1000 keys per request"""
+    for start in range(0, len(keys), 1000):
+        s3_client.delete_objects(
+            Bucket=settings.AWS_STORAGE_BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True},
+        )
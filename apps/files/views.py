@@ -1,6 +1,7 @@
 import logging
 # from os import remove as delete_file
 
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.http import Http404
 from drf_yasg import openapi
@@ -8,10 +9,15 @@ from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny
+from rest_framework.generics import CreateAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from apps.files.models import File
+from apps.files.models import File, UploadSession
+from apps.files.serializers import UploadSessionSerializer, DirectUploadSerializer, DirectUploadCompleteSerializer
+from apps.files.swagger import upload_chunk_swagger_params
+from apps.files.uploads import (create_upload_session, upload_chunk, complete_upload_session, presign_direct_upload,
+                               complete_direct_upload)
 from apps.files.utils import upload_file, delete_file
 from config.core.api_exceptions import APIValidation
 
@@ -38,7 +44,7 @@ class FileCreateAPIView(APIView):
         if not file:
             raise APIValidation(detail=_('Файл не был отправлен'), code=status.HTTP_400_BAD_REQUEST)
 
-        if file.size > 524_288_000:
+        if file.size > settings.FILE_UPLOAD_MAX_SIZE:
             raise APIValidation(detail=_('Размер файла превысил 500 МБ!'), code=status.HTTP_400_BAD_REQUEST)
 
         e_file = upload_file(file=file)
@@ -63,8 +69,95 @@ class FileDeleteAPIView(APIView):
     def delete(self, request, pk):
         file = self.get_object(pk)
         delete_file(file)
-        file.delete()
         return Response({
             'message': _('Файл успешно удален'),
             'status': status.HTTP_200_OK
         }, status=status.HTTP_200_OK)
+
+
+class UploadSessionCreateAPIView(CreateAPIView):
+    """
+    Starts a resumable upload: send the file in chunk_size pieces to the session,
+    GET the session to see missing_offsets after a broken connection, then complete it
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [AllowAny, ]
+
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        serializer.instance = create_upload_session(data['name'], data['size'], data.get('content_type'),
+                                                    data.get('checksum'))
+
+
+class UploadSessionAPIView(APIView):
+    permission_classes = [AllowAny, ]
+
+    @staticmethod
+    def get_object(pk):
+        try:
+            return UploadSession.objects.get(pk=pk)
+        except UploadSession.DoesNotExist:
+            raise Http404
+
+    @swagger_auto_schema(responses={200: UploadSessionSerializer})
+    def get(self, request, pk):
+        return Response(UploadSessionSerializer(self.get_object(pk)).data)
+
+    @swagger_auto_schema(
+        operation_description='Upload a chunk of the file, the request body is the raw bytes of the chunk',
+        manual_parameters=upload_chunk_swagger_params,
+        responses={200: UploadSessionSerializer},
+    )
+    def put(self, request, pk):
+        session = self.get_object(pk)
+        try:
+            offset = int(request.query_params['offset'])
+        except (KeyError, ValueError):
+            raise APIValidation(detail=_('Неверное смещение части файла'), status_code=status.HTTP_400_BAD_REQUEST)
+
+        # the body is read directly, one byte over chunk_size is enough to detect an oversized chunk
+        data = request.read(session.chunk_size + 1)
+        upload_chunk(session, offset, data, request.headers.get('X-Chunk-Checksum'))
+        return Response(UploadSessionSerializer(session).data)
+
+
+class UploadSessionCompleteAPIView(APIView):
+    permission_classes = [AllowAny, ]
+
+    @swagger_auto_schema(responses={200: UploadSessionSerializer})
+    def post(self, request, pk):
+        session = UploadSessionAPIView.get_object(pk)
+        complete_upload_session(session)
+        return Response(UploadSessionSerializer(session).data)
+
+
+class DirectUploadAPIView(APIView):
+    """
+    Issues presigned POST and PUT requests for uploading straight to MinIO,
+    the returned token is sent to the complete endpoint afterwards
+    """
+    permission_classes = [AllowAny, ]
+
+    @swagger_auto_schema(request_body=DirectUploadSerializer)
+    def post(self, request):
+        serializer = DirectUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        return Response(presign_direct_upload(data['name'], data['size'], data.get('content_type')),
+                        status=status.HTTP_201_CREATED)
+
+
+class DirectUploadCompleteAPIView(APIView):
+    permission_classes = [AllowAny, ]
+
+    @swagger_auto_schema(request_body=DirectUploadCompleteSerializer)
+    def post(self, request):
+        serializer = DirectUploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        e_file = complete_direct_upload(serializer.validated_data['token'])
+        return Response({
+            'message': _('Файл успешно загружен'),
+            'file': e_file.id,
+            'path': e_file.path,
+            'status': status.HTTP_201_CREATED
+        }, status=status.HTTP_201_CREATED)
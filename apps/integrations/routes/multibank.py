@@ -6,6 +6,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.authentication.models import User, Card
+from apps.chat.services import invalidate_chat_access
 from apps.integrations.models import MultibankTransaction, MultibankTransactionStatusEnum
 
 logger = logging.getLogger()
@@ -69,11 +70,13 @@ class MultiBankPaymentCallbackWebhookAPIView(APIView):
                 transaction.subscription.is_active = True
                 transaction.subscription.is_paid = True
                 transaction.subscription.save()
+                invalidate_chat_access(transaction.subscription.subscriber_id, transaction.subscription.creator_id)
                 transaction.status = 'paid'
 
             elif transaction.donation:
                 transaction.donation.is_active = True
                 transaction.donation.save()
+                invalidate_chat_access(transaction.donation.donator_id, transaction.donation.creator_id)
                 transaction.status = 'paid'
 
                 if transaction.donation.fundraising_id:
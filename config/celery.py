@@ -34,4 +34,16 @@ app.conf.beat_schedule = {
         'task': 'apps.authentication.tasks.resubscribe_task',
         'schedule': crontab(minute=0, hour='0,12'),
     },
+    'run-cron-message-partitions-task': {
+        'task': 'apps.chat.tasks.manage_message_partitions_task',
+        'schedule': crontab(minute=0, hour=3),
+    },
+    'run-cron-upload-sessions-cleanup-task': {
+        'task': 'apps.files.tasks.cleanup_upload_sessions_task',
+        'schedule': crontab(minute=30),
+    },
+    'run-cron-orphaned-files-task': {
+        'task': 'apps.files.tasks.collect_orphaned_files_task',
+        'schedule': crontab(minute=0, hour=4),
+    },
 }
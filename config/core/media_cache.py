@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger()
+
+METRICS = ('hit', 'miss', 'bypass', 'evicted')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+TEMP_SUFFIX = '.part'
+
+_evictor_lock = threading.Lock()
+_evictor = None
+
+
+def cache_path(key, etag):
+    """Cached objects are named by key and ETag, so an overwritten object never matches a stale file"""
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(settings.MEDIA_CACHE['DIR'], digest[:2], f'{digest}-{etag.strip(chr(34))}')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(range_header, size):
+    """
+    Returns (start, end) inclusive for a single byte range, None when the header is absent or unsupported;
+    raises RangeNotSatisfiable when the range selects no byte of the object
+    """
+    match = RANGE_RE.match(range_header or '')
+    if not match or not (match[1] or match[2]):
+        return None
+    if not match[1]:
+        suffix_length = int(match[2])
+        if not suffix_length or not size:
+            raise RangeNotSatisfiable
+        return max(size - suffix_length, 0), size - 1
+
+    start = int(match[1])
+    end = min(int(match[2]), size - 1) if match[2] else size - 1
+    if match[2] and start > int(match[2]):
+        # invalid, the header is ignored
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def incr_metric(name, delta=1):
+    key = f'media_cache_metrics:{name}'
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, timeout=None)
+
+
+async def aincr_metric(name, delta=1):
+    key = f'media_cache_metrics:{name}'
+    try:
+        await cache.aincr(key, delta)
+    except ValueError:
+        await cache.aset(key, delta, timeout=None)
+
+
+def get_metrics():
+    values = cache.get_many([f'media_cache_metrics:{name}' for name in METRICS])
+    return {name: values.get(f'media_cache_metrics:{name}', 0) for name in METRICS}
+
+
+def open_cached(path):
+    """
+    Opens a cached file and marks it as recently used, None on a miss;
+    the open file stays readable when the evictor removes it meanwhile
+    """
+    try:
+        source = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    os.utime(source.fileno())
+    return source
+
+
+async def store(path, body):
+    """Writes an aiobotocore streaming body next to its final place and moves it in atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{uuid.uuid4().hex}{TEMP_SUFFIX}'
+    try:
+        with open(temp_path, 'wb') as destination:
+            async with body:
+                async for chunk in body.iter_chunks(settings.MEDIA_STREAM_CHUNK_SIZE):
+                    await asyncio.to_thread(destination.write, chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    start_evictor()
+    return path
+
+
+async def iter_file(source, start, length):
+    """
+    Reads a byte range of an open cached file in a worker thread chunk by chunk and closes it;
+    under ASGI there is no sendfile and FileResponse would read the whole file into memory
+    """
+    with source:
+        source.seek(start)
+        while length > 0:
+            chunk = await asyncio.to_thread(source.read, min(settings.MEDIA_STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def evict():
+    """Removes least recently used files until the cache is below 90% of MAX_SIZE, returns the count"""
+    files = []
+    total_size = 0
+    now = time.time()
+    for root, _, names in os.walk(settings.MEDIA_CACHE['DIR']):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if name.endswith(TEMP_SUFFIX):
+                # leftovers of interrupted downloads
+                if now - stat.st_mtime > 60 * 60:
+                    os.remove(path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+    evicted = 0
+    low_watermark = settings.MEDIA_CACHE['MAX_SIZE'] * 0.9
+    if total_size > settings.MEDIA_CACHE['MAX_SIZE']:
+        for _, size, path in sorted(files):
+            if total_size <= low_watermark:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            evicted += 1
+    return evicted
+
+
+def run_evictor():
+    while True:
+        time.sleep(settings.MEDIA_CACHE['EVICT_INTERVAL'])
+        try:
+            evicted = evict()
+            if evicted:
+                incr_metric('evicted', evicted)
+                logger.info(f'Media cache evicted {evicted} files;')
+        except Exception as e:
+            logger.exception(f'Media cache eviction failed: {e.args};')
+
+
+def start_evictor():
+    """Starts the per-process eviction thread on first use"""
+    global _evictor
+    if _evictor is not None:
+        return
+    with _evictor_lock:
+        if _evictor is None:
+            _evictor = threading.Thread(target=run_evictor, name='media-cache-evictor', daemon=True)
+            _evictor.start()
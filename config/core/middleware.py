@@ -2,17 +2,30 @@ import logging
 
 logger = logging.getLogger('request_logger')
 
+# bodies of these types are logged, anything else (multipart uploads, binary) only by size
+LOGGED_CONTENT_TYPES = ('application/json', 'application/x-www-form-urlencoded', 'text/plain')
+MAX_LOGGED_BODY_SIZE = 64 * 1024
+
 
 class RequestLogMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Read and decode request body safely
         try:
-            body = request.body.decode('utf-8')
-        except Exception:
-            body = '[Unreadable Body]'
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+
+        # Reading request.body would pull whole uploads into memory and stop Django from spooling them to disk
+        if request.content_type in LOGGED_CONTENT_TYPES and content_length <= MAX_LOGGED_BODY_SIZE:
+            # Read and decode request body safely
+            try:
+                body = request.body.decode('utf-8')
+            except Exception:
+                body = '[Unreadable Body]'
+        else:
+            body = f'[{request.content_type or "no content type"}, {content_length} bytes]'
 
         logger.info(f'{request.method} {request.path} - Body: {body}')
 
@@ -1,20 +1,101 @@
 from django.conf import settings
 
+import asyncio
+import logging
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from typing import Iterable, Iterator, Union
 
 import boto3
 import botocore
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 
+logger = logging.getLogger()
+
+# boto3 clients are thread safe, one client and its connection pool serve the whole process
 s3_client = boto3.client(
     's3',
     endpoint_url=settings.AWS_S3_ENDPOINT_URL,
     aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
     aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    config=Config(
+        signature_version='s3v4',
+        max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+    ),
+)
+
+# signs URLs for the endpoint visible to clients, presigning is local and never calls MinIO
+public_s3_client = s3_client if settings.AWS_S3_PUBLIC_ENDPOINT_URL == settings.AWS_S3_ENDPOINT_URL else boto3.client(
+    's3',
+    endpoint_url=settings.AWS_S3_PUBLIC_ENDPOINT_URL,
+    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+    config=Config(signature_version='s3v4'),
+)
+
+# multipart uploads keep about multipart_chunksize * max_concurrency bytes in memory per upload
+s3_transfer_config = TransferConfig(
+    multipart_threshold=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+    multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNK_SIZE,
+    max_concurrency=settings.AWS_S3_MULTIPART_CONCURRENCY,
+    use_threads=True,
 )
 
+_async_s3_clients = weakref.WeakKeyDictionary()
+
+
+async def get_async_s3_client():
+    """
+    aiobotocore client shared by everything running on the current event loop;
+    aiohttp connections are bound to a loop, so every loop gets its own client
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_s3_clients.get(loop)
+    if client is None:
+        client_context = get_session().create_client(
+            's3',
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+            config=AioConfig(
+                signature_version='s3v4',
+                max_pool_connections=settings.AWS_S3_MAX_POOL_CONNECTIONS,
+                connector_args={'keepalive_timeout': 30},
+                retries={'max_attempts': 3, 'mode': 'standard'},
+            ),
+        )
+        new_client = await client_context.__aenter__()
+        # another coroutine may have created the client while this one was awaiting
+        client = _async_s3_clients.setdefault(loop, new_client)
+        if client is not new_client:
+            await client_context.__aexit__(None, None, None)
+    return client
+
+
+async def iter_object_body(body, chunk_size=None):
+    """Yields an aiobotocore streaming body in chunks, the connection goes back to the pool when done"""
+    async with body:
+        async for chunk in body.iter_chunks(chunk_size or settings.MEDIA_STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def presigned_media_url(key, public=False, expires=None, **params):
+    """params are extra get_object parameters, e.g. ResponseCacheControl overriding the stored header"""
+    client = public_s3_client if public else s3_client
+    return client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': settings.AWS_STORAGE_BUCKET_NAME, 'Key': key, **params},
+        ExpiresIn=expires or settings.MEDIA_PRESIGNED_URL_EXPIRES,
+    )
+
+
 def ensure_minio_bucket():
     try:
         s3_client.head_bucket(Bucket=settings.AWS_STORAGE_BUCKET_NAME)
@@ -29,17 +110,25 @@ def ensure_minio_bucket():
 
 
 class S3BucketService:
+    """
+    Bucket helper for maintenance scripts; one client and its connection pool serve every call of an instance,
+    sized for the upload_many worker threads
+    """
+
     def __init__(
             self,
             bucket_name: str,
             endpoint: str,
             access_key: str,
             secret_key: str,
+            max_workers: int = 16,
     ) -> None:
         self.bucket_name = bucket_name
         self.endpoint = endpoint
         self.access_key = access_key
         self.secret_key = secret_key
+        self.max_workers = max_workers
+        self.client = self.create_s3_client()
 
     def create_s3_client(self) -> boto3.client:
         client = boto3.client(
@@ -47,7 +136,12 @@ class S3BucketService:
             endpoint_url=self.endpoint,
             aws_access_key_id=self.access_key,
             aws_secret_access_key=self.secret_key,
-            config=Config(signature_version="s3v4"),
+            config=Config(
+                signature_version="s3v4",
+                max_pool_connections=self.max_workers,
+                tcp_keepalive=True,
+                retries={"max_attempts": 3, "mode": "standard"},
+            ),
         )
         return client
 
@@ -57,32 +151,72 @@ class S3BucketService:
             source_file_name: str,
             content: Union[str, bytes],
     ) -> None:
-        client = self.create_s3_client()
         destination_path = str(Path(prefix, source_file_name))
 
         if isinstance(content, bytes):
             buffer = BytesIO(content)
         else:
             buffer = BytesIO(content.encode("utf-8"))
-        client.upload_fileobj(buffer, self.bucket_name, destination_path)
-
-    def list_objects(self, prefix: str) -> list[str]:
-        client = self.create_s3_client()
-
-        response = client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
-        storage_content: list[str] = []
+        self.client.upload_fileobj(buffer, self.bucket_name, destination_path)
 
-        try:
-            contents = response["Contents"]
-        except KeyError:
-            return storage_content
+    def upload_many(
+            self,
+            prefix: str,
+            files: Iterable[tuple[str, Union[str, bytes]]],
+    ) -> int:
+        """
+        Uploads (source_file_name, content) pairs with max_workers threads; at most twice as many uploads
+        are in flight, so a long generator of files is not read into memory at once
+        """
+        uploaded = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for source_file_name, content in files:
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                        uploaded += 1
+                pending.add(executor.submit(self.upload_file_object, prefix, source_file_name, content))
+            for future in as_completed(pending):
+                future.result()
+                uploaded += 1
+        return uploaded
 
-        for item in contents:
-            storage_content.append(item["Key"])
+    def iter_objects(self, prefix: str) -> Iterator[str]:
+        """Yields every key under prefix, page by page"""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"]
 
-        return storage_content
+    def list_objects(self, prefix: str) -> list[str]:
+        return list(self.iter_objects(prefix))
 
     def delete_file_object(self, prefix: str, source_file_name: str) -> None:
-        client = self.create_s3_client()
         path_to_file = str(Path(prefix, source_file_name))
-        client.delete_object(Bucket=self.bucket_name, Key=path_to_file)
+        self.client.delete_object(Bucket=self.bucket_name, Key=path_to_file)
+
+    def delete_many(self, keys: Iterable[str]) -> int:
+        """Deletes keys with delete_objects, 1000 keys per request, returns the number of deleted keys"""
+        deleted = 0
+        batch: list[str] = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) == 1000:
+                deleted += self.delete_batch(batch)
+                batch = []
+        if batch:
+            deleted += self.delete_batch(batch)
+        return deleted
+
+    def delete_batch(self, keys: list[str]) -> int:
+        response = self.client.delete_objects(
+            Bucket=self.bucket_name,
+            Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+        )
+        # in quiet mode only the keys that failed are reported
+        errors = response.get("Errors", [])
+        for error in errors:
+            logger.error(f"S3 delete of {error['Key']} failed: {error['Code']} {error.get('Message')};")
+        return len(keys) - len(errors)
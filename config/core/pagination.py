@@ -1,8 +1,11 @@
 from math import ceil
 
-from rest_framework import pagination
+from django.utils.translation import gettext_lazy as _
+from rest_framework import pagination, status
 from rest_framework.response import Response
 
+from config.core.api_exceptions import APIValidation
+
 
 class APIPagination(pagination.PageNumberPagination):
     page_size = 10
@@ -37,3 +40,73 @@ class APILimitOffsetPagination(pagination.LimitOffsetPagination):
             'previous': self.get_previous_link(),
             'results': data
         })
+
+
+class APIKeysetPagination(pagination.BasePagination):
+    """
+    Keyset pagination over an increasing integer key;
+    accepts one of `before`, `after` or `around` cursors and returns results newest first
+    """
+    cursor_field = 'id'
+    default_limit = 20
+    limit_query_param = 'limit'
+    max_limit = 500
+    cursor_query_params = ('before', 'after', 'around')
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def get_cursor(self, request):
+        for param in self.cursor_query_params:
+            value = request.query_params.get(param)
+            if value is not None:
+                try:
+                    return param, int(value)
+                except ValueError:
+                    raise APIValidation(_('Неверный курсор'), status_code=status.HTTP_400_BAD_REQUEST)
+        return None, None
+
+    def fetch_older(self, queryset, cursor, limit, inclusive=False):
+        lookup = f'{self.cursor_field}__lte' if inclusive else f'{self.cursor_field}__lt'
+        if cursor is not None:
+            queryset = queryset.filter(**{lookup: cursor})
+        items = list(queryset.order_by(f'-{self.cursor_field}')[:limit + 1])
+        return items[:limit], len(items) > limit
+
+    def fetch_newer(self, queryset, cursor, limit, inclusive=False):
+        lookup = f'{self.cursor_field}__gte' if inclusive else f'{self.cursor_field}__gt'
+        items = list(queryset.filter(**{lookup: cursor}).order_by(self.cursor_field)[:limit + 1])
+        return items[:limit][::-1], len(items) > limit
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = limit = self.get_limit(request)
+        self.param, self.cursor = param, cursor = self.get_cursor(request)
+
+        if param == 'after':
+            items, self.has_after = self.fetch_newer(queryset, cursor, limit)
+            self.has_before = True
+        elif param == 'around':
+            newer_limit = limit - limit // 2
+            newer, self.has_after = self.fetch_newer(queryset, cursor, newer_limit, inclusive=True)
+            older, self.has_before = self.fetch_older(queryset, cursor, limit - newer_limit)
+            items = newer + older
+        else:
+            items, self.has_before = self.fetch_older(queryset, cursor, limit)
+            self.has_after = param == 'before'
+
+        self.items = items
+        return items
+
+    def get_paginated_response(self, data):
+        first = getattr(self.items[0], self.cursor_field) if self.items else None
+        last = getattr(self.items[-1], self.cursor_field) if self.items else None
+        return Response({
+            'before': last if self.has_before else None,
+            'after': first if self.has_after else None,
+            'results': data
+        })
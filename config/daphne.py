@@ -0,0 +1,94 @@
+"""
+Daphne entrypoint accepting permessage-deflate and dropping WebSocket clients that stop reading;
+stock Daphne never negotiates WebSocket compression and buffers outgoing frames without a bound.
+Usage: python -m config.daphne -b 0.0.0.0 -p 8000 config.asgi:application
+"""
+import logging
+import time
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import server
+from daphne.cli import CommandLineInterface
+from daphne.ws_protocol import WebSocketFactory, WebSocketProtocol
+from django.conf import settings
+
+logger = logging.getLogger()
+
+
+def accept_permessage_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+class SlowConsumerGuard:
+    """
+    Twisted marks the transport producer as paused while the socket write buffer is full, i.e. the client
+    does not read; the connection is dropped when it stays paused for longer than SLOW_CONSUMER_TIMEOUT
+    seconds or the unsent data grows past SLOW_CONSUMER_MAX_BYTES
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.paused_at = None
+
+    def buffered_bytes(self):
+        # FileDescriptor keeps written data in dataBuffer (sent up to offset) and in _tempDataBuffer
+        transport = self.protocol.transport
+        return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+    def is_paused(self):
+        # the upgraded HTTP channel stays registered as the streaming producer of the transport
+        if not self.protocol.transport.producerPaused:
+            self.paused_at = None
+        elif self.paused_at is None:
+            self.paused_at = time.monotonic()
+        return self.paused_at is not None
+
+    def written(self):
+        if self.is_paused() and self.buffered_bytes() > settings.CHAT_FLOW_CONTROL['SLOW_CONSUMER_MAX_BYTES']:
+            self.drop()
+
+    def check(self):
+        if self.is_paused() and time.monotonic() - self.paused_at > settings.CHAT_FLOW_CONTROL['SLOW_CONSUMER_TIMEOUT']:
+            self.drop()
+
+    def drop(self):
+        logger.info(f'Slow websocket consumer dropped: {self.protocol.client_addr}; '
+                    f'buffered bytes: {self.buffered_bytes()};')
+        self.paused_at = None
+        # a close frame would wait behind the unread data, the connection is aborted instead
+        self.protocol.dropConnection(abort=True)
+
+
+class FlowControlledWebSocketProtocol(WebSocketProtocol):
+    slow_consumer_guard = None
+
+    def onOpen(self):
+        super().onOpen()
+        self.slow_consumer_guard = SlowConsumerGuard(self)
+
+    def serverSend(self, content, binary=False):
+        super().serverSend(content, binary)
+        if self.slow_consumer_guard is not None:
+            self.slow_consumer_guard.written()
+
+    def check_timeouts(self):
+        super().check_timeouts()
+        if self.slow_consumer_guard is not None:
+            self.slow_consumer_guard.check()
+
+
+class CompressingWebSocketFactory(WebSocketFactory):
+    protocol = FlowControlledWebSocketProtocol
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+
+
+server.WebSocketFactory = CompressingWebSocketFactory
+
+if __name__ == '__main__':
+    CommandLineInterface.entrypoint()
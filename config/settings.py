@@ -155,6 +155,43 @@ STATIC_ROOT = join_path(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = join_path(BASE_DIR, 'media')
 FILE_UPLOAD_DIR = join_path(MEDIA_ROOT, 'uploads')
+# uploads above FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to temporary files instead of memory
+FILE_UPLOAD_MAX_MEMORY_SIZE = 2_621_440
+FILE_UPLOAD_TEMP_DIR = getenv('FILE_UPLOAD_TEMP_DIR') or None
+FILE_UPLOAD_MAX_SIZE = 524_288_000
+# Resumable uploads, every chunk becomes an S3 multipart part, so CHUNK_SIZE may not be below 5 MB
+FILE_UPLOAD_SESSION = {
+    'CHUNK_SIZE': 8 * 1024 * 1024,
+    'TTL': 60 * 60 * 24,
+    'CLEANUP_BATCH_SIZE': 100,
+}
+# ffmpeg transcoding of post media: HLS renditions for video, Opus and AAC for music.
+# Renditions taller than the source are skipped, bitrates are ffmpeg values
+MEDIA_TRANSCODING = {
+    'FFMPEG': getenv('FFMPEG_BINARY', 'ffmpeg'),
+    'FFPROBE': getenv('FFPROBE_BINARY', 'ffprobe'),
+    'TEMP_DIR': getenv('MEDIA_TRANSCODING_TEMP_DIR') or None,
+    'TIMEOUT': 60 * 60,
+    'HLS_SEGMENT_DURATION': 6,
+    'VIDEO_RENDITIONS': [
+        {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '96k'},
+        {'name': '720p', 'height': 720, 'video_bitrate': '2800k', 'audio_bitrate': '128k'},
+        {'name': '1080p', 'height': 1080, 'video_bitrate': '5000k', 'audio_bitrate': '128k'},
+    ],
+    'AUDIO_BITRATES': {'opus': '96k', 'aac': '128k'},
+    # demuxers allowed to open uploads; playlist and concat formats (hls, concat, ...) must never be listed
+    'FORMATS': ['mov', 'matroska', 'webm', 'avi', 'mpegts', 'asf', 'flv', 'mp3', 'ogg', 'wav', 'flac', 'aac',
+                'amr'],
+}
+# Garbage collection of files nothing references, GRACE_PERIOD in seconds leaves time to attach fresh uploads
+FILE_GC = {
+    'GRACE_PERIOD': 60 * 60 * 24,
+    'BATCH_SIZE': 500,
+}
+# Lifetime of presigned upload policies that let clients send files straight to MinIO
+FILE_DIRECT_UPLOAD_EXPIRES = 60 * 15
+# direct uploads land here and are moved to uploads/ on completion; never list it in MEDIA_PUBLIC_PREFIXES
+FILE_DIRECT_UPLOAD_STAGING_PREFIX = 'staging/'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -182,6 +219,28 @@ AWS_DEFAULT_ACL = None  # Optional: use None for default ACL
 # AWS_S3_CUSTOM_DOMAIN = 'api.sapi.uz'
 AWS_S3_USE_SSL = False
 AWS_QUERYSTRING_AUTH = False
+AWS_S3_MAX_POOL_CONNECTIONS = int(getenv('AWS_S3_MAX_POOL_CONNECTIONS', 50))
+AWS_S3_MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+AWS_S3_MULTIPART_CONCURRENCY = 4
+MEDIA_STREAM_CHUNK_SIZE = 64 * 1024
+# keys under these prefixes are never overwritten, so clients may cache them forever
+MEDIA_IMMUTABLE_PREFIXES = ('uploads/',)
+# only keys under these prefixes are served on /media/, e.g. chat archives stay private
+MEDIA_PUBLIC_PREFIXES = ('uploads/',)
+# Media delivery: 'stream' sends bytes through Django, 'accel' hands the download over to nginx
+# with X-Accel-Redirect, 'redirect' sends clients to a short lived presigned MinIO URL
+MEDIA_DELIVERY = getenv('MEDIA_DELIVERY', 'stream')
+MEDIA_ACCEL_LOCATION = '/internal-media/'
+MEDIA_PRESIGNED_URL_EXPIRES = 60 * 5
+AWS_S3_PUBLIC_ENDPOINT_URL = getenv('MINIO_PUBLIC_URL') or AWS_S3_ENDPOINT_URL
+# Local disk LRU cache of small hot media objects for the 'stream' delivery, sizes in bytes
+MEDIA_CACHE = {
+    'ENABLED': bool(int(getenv('MEDIA_CACHE_ENABLED', 0))),
+    'DIR': getenv('MEDIA_CACHE_DIR') or join_path(MEDIA_ROOT, 'cache'),
+    'MAX_SIZE': int(getenv('MEDIA_CACHE_MAX_SIZE_MB', 2048)) * 1024 * 1024,
+    'MAX_OBJECT_SIZE': 20 * 1024 * 1024,
+    'EVICT_INTERVAL': 60,
+}
 
 # SMS Integration
 SMS_INTEGRATION_SETTINGS = {
@@ -238,6 +297,16 @@ CELERY_BROKER_URL = getenv('BROKER_URL')
 CELERY_RESULT_BACKEND = getenv('BROKER_URL')
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+# Cache
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': getenv('REDIS_URL'),
+    } if getenv('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Debug Toolbar
 if DEBUG:
     def show_toolbar(request):
@@ -278,6 +347,40 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Chat websocket flow control: rates are messages per second per connection and per window per user;
+# a client whose socket buffer stays full for SLOW_CONSUMER_TIMEOUT seconds or falls SLOW_CONSUMER_MAX_BYTES
+# behind is dropped by config.daphne
+CHAT_FLOW_CONTROL = {
+    'CONNECTION_RATE': 5,
+    'CONNECTION_BURST': 20,
+    'USER_WINDOW': 60,
+    'USER_MESSAGES_PER_WINDOW': 300,
+    'MAX_REJECTED_IN_ROW': 50,
+    'SEND_QUEUE_SIZE': 256,
+    'SLOW_CONSUMER_TIMEOUT': 30,
+    'SLOW_CONSUMER_MAX_BYTES': 1024 * 1024,
+}
+# Chat presence and typing live in the cache only: TTL and HEARTBEAT of presence keys in seconds,
+# at most one typing event per room every TYPING_INTERVAL seconds for a connection
+CHAT_PRESENCE = {
+    'TTL': 60,
+    'HEARTBEAT': 20,
+    'LAST_SEEN_TTL': 60 * 60 * 24 * 30,
+    'TYPING_INTERVAL': 3,
+    'BATCH_SIZE': 200,
+}
+# Creator broadcasts are fanned out in chunks of rooms, socket events are sent concurrently in batches
+CHAT_BROADCAST = {
+    'CHUNK_SIZE': 1000,
+    'EVENT_BATCH_SIZE': 500,
+}
+
+# Chat message partitioning and archival of cold partitions into MinIO
+CHAT_MESSAGE_PARTITION_MONTHS_AHEAD = 2
+CHAT_MESSAGE_ARCHIVE_ENABLED = bool(int(getenv('CHAT_MESSAGE_ARCHIVE_ENABLED', 0)))
+CHAT_MESSAGE_ARCHIVE_AFTER_MONTHS = int(getenv('CHAT_MESSAGE_ARCHIVE_AFTER_MONTHS', 12))
+CHAT_MESSAGE_ARCHIVE_PREFIX = 'archive/chat_message'
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -1,5 +1,5 @@
-import boto3
-from botocore.config import Config
+from urllib.parse import urlsplit
+
 from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
@@ -9,9 +9,17 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from storages.backends.s3boto3 import S3Boto3Storage
-from django.http import FileResponse, StreamingHttpResponse, Http404
+from django.http import FileResponse, StreamingHttpResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views import View
 
+from config.core import media_cache
 from config.core.api_exceptions import APIValidation
+from config.core.minio import get_async_s3_client, iter_object_body, presigned_media_url
+
+MEDIA_META_CACHE_TIMEOUT = 60 * 60 * 24
 
 
 class BaseModelViewSet(ModelViewSet):
@@ -21,8 +29,12 @@ class BaseModelViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'put', 'patch', 'delete']
 
 
-class MediaPath(APIView):
-    permission_classes = [AllowAny, ]
+class MediaPath(View):
+    """
+    Serves MinIO objects according to MEDIA_DELIVERY: streamed with the shared async S3 client,
+    handed over to nginx with X-Accel-Redirect, or redirected to a presigned URL;
+    the access check and conditional requests are handled here before any of them
+    """
 
     # @staticmethod
     # def get(request, path):
@@ -32,37 +44,189 @@ class MediaPath(APIView):
     #         return FileResponse(file)
     #     except Exception as e:
     #         raise APIValidation(e.args, status_code=status.HTTP_404_NOT_FOUND)
-    def get(self, request, path):
-        s3 = boto3.client(
-            's3',
-            aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
-            config=Config(signature_version='s3v4'),
-        )
+    async def get(self, request, path):
+        self.check_access(path)
+        s3 = await get_async_s3_client()
         bucket = settings.AWS_STORAGE_BUCKET_NAME
+        meta = await self.get_object_meta(s3, bucket, path)
+
+        # conditional requests are answered from metadata only, without body bytes
+        headers = self.caching_headers(path, meta)
+        conditional_resp = get_conditional_response(
+            request,
+            etag=meta['ETag'],
+            last_modified=meta['LastModified'],
+            response=self.with_headers(HttpResponse(), headers),
+        )
+        if conditional_resp.status_code in (304, 412):
+            return conditional_resp
+
+        if settings.MEDIA_DELIVERY == 'accel':
+            return self.with_headers(self.accel_redirect(path), headers)
+        # players resolve relative HLS segment URLs against the playlist URL, playlists must stay on /media/
+        if settings.MEDIA_DELIVERY == 'redirect' and not path.endswith('.m3u8'):
+            return self.presigned_redirect(path, headers)
 
         range_header = request.headers.get('Range')
+        if range_header and not self.if_range_passes(request, meta):
+            range_header = None
         try:
-            extra_args = {}
-            if range_header:
-                extra_args['Range'] = range_header
+            byte_range = media_cache.parse_range(range_header, meta['ContentLength'])
+        except media_cache.RangeNotSatisfiable:
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = f'bytes */{meta["ContentLength"]}'
+            return self.with_headers(resp, headers)
+
+        resp = None
+        if settings.MEDIA_CACHE['ENABLED'] and meta['ContentLength'] <= settings.MEDIA_CACHE['MAX_OBJECT_SIZE']:
+            resp = await self.cached_response(s3, bucket, path, byte_range, meta)
+        if resp is None:
+            if settings.MEDIA_CACHE['ENABLED']:
+                await media_cache.aincr_metric('bypass')
+            resp = await self.streamed_response(s3, bucket, path, byte_range)
+        return self.with_headers(resp, headers)
+
+    @staticmethod
+    def check_access(path):
+        """Media URLs are public, but only for uploaded files; other keys of the bucket are never served"""
+        if not path.startswith(settings.MEDIA_PUBLIC_PREFIXES) or '..' in path.split('/'):
+            raise Http404('File not found')
+
+    @staticmethod
+    async def get_object_meta(s3, bucket, path):
+        """head_object result, cached for a day for immutable keys and briefly for the rest"""
+        cache_key = f'media_meta:{path}'
+        meta = await cache.aget(cache_key)
+        if meta is None:
+            try:
+                head = await s3.head_object(Bucket=bucket, Key=path)
+            except Exception as e:
+                raise Http404('File not found')
+            meta = {
+                'ETag': head['ETag'],
+                'ContentLength': head['ContentLength'],
+                'ContentType': head['ContentType'],
+                'LastModified': int(head['LastModified'].timestamp()),
+            }
+            is_immutable = path.startswith(settings.MEDIA_IMMUTABLE_PREFIXES)
+            await cache.aset(cache_key, meta, MEDIA_META_CACHE_TIMEOUT if is_immutable else 60)
+        return meta
+
+    @staticmethod
+    def caching_headers(path, meta):
+        if path.startswith(settings.MEDIA_IMMUTABLE_PREFIXES):
+            # upload keys are unique codes, their content never changes
+            cache_control = 'public, max-age=31536000, immutable'
+        else:
+            cache_control = 'public, no-cache'
+        return {
+            'ETag': meta['ETag'],
+            'Last-Modified': http_date(meta['LastModified']),
+            'Cache-Control': cache_control,
+        }
 
-            obj = s3.get_object(Bucket=bucket, Key=path, **extra_args)
+    @staticmethod
+    def with_headers(resp, headers):
+        for name, value in headers.items():
+            resp[name] = value
+        return resp
 
-            resp = StreamingHttpResponse(obj['Body'].iter_chunks(), status=206 if range_header else 200)
-            resp['Content-Type'] = obj['ContentType']
-            resp['Accept-Ranges'] = 'bytes'
+    @staticmethod
+    def if_range_passes(request, meta):
+        """Range is honoured only while If-Range still matches the current representation"""
+        if_range = request.headers.get('If-Range')
+        if not if_range:
+            return True
+        if if_range.startswith(('"', 'W/')):
+            # If-Range requires a strong comparison
+            return if_range == meta['ETag']
+        return parse_http_date_safe(if_range) == meta['LastModified']
 
-            if 'ContentRange' in obj:
-                resp['Content-Range'] = obj['ContentRange']
-            if 'ContentLength' in obj:
-                resp['Content-Length'] = str(obj['ContentLength'])
+    @staticmethod
+    async def streamed_response(s3, bucket, path, byte_range):
+        """Only the parsed range goes upstream, a Range header ignored by parse_range gets the whole object"""
+        try:
+            extra_args = {}
+            if byte_range:
+                start, end = byte_range
+                extra_args['Range'] = f'bytes={start}-{end}'
 
-            return resp
+            obj = await s3.get_object(Bucket=bucket, Key=path, **extra_args)
         except Exception as e:
             raise Http404('File not found')
 
+        resp = StreamingHttpResponse(iter_object_body(obj['Body']), status=206 if byte_range else 200)
+        resp['Content-Type'] = obj['ContentType']
+        resp['Accept-Ranges'] = 'bytes'
+
+        if 'ContentRange' in obj:
+            resp['Content-Range'] = obj['ContentRange']
+        if 'ContentLength' in obj:
+            resp['Content-Length'] = str(obj['ContentLength'])
+
+        return resp
+
+    @staticmethod
+    async def cached_response(s3, bucket, path, byte_range, meta):
+        """
+        Serves an object from the local disk cache, downloading it there first on a miss;
+        None when the downloaded file was evicted before it could be opened
+        """
+        cached_path = media_cache.cache_path(path, meta['ETag'])
+        source = media_cache.open_cached(cached_path)
+        if source:
+            cache_status = 'hit'
+        else:
+            cache_status = 'miss'
+            try:
+                obj = await s3.get_object(Bucket=bucket, Key=path, IfMatch=meta['ETag'])
+            except Exception as e:
+                raise Http404('File not found')
+            await media_cache.store(cached_path, obj['Body'])
+            source = media_cache.open_cached(cached_path)
+            if source is None:
+                return None
+        await media_cache.aincr_metric(cache_status)
+
+        size = meta['ContentLength']
+        start, end = byte_range or (0, size - 1)
+        resp = StreamingHttpResponse(media_cache.iter_file(source, start, end - start + 1),
+                                     status=206 if byte_range else 200)
+        resp['Content-Type'] = meta['ContentType']
+        resp['Accept-Ranges'] = 'bytes'
+        resp['Content-Length'] = str(end - start + 1)
+        if byte_range:
+            resp['Content-Range'] = f'bytes {start}-{end}/{size}'
+        resp['X-Media-Cache'] = cache_status.upper()
+        return resp
+
+    @staticmethod
+    def accel_redirect(path):
+        """
+        nginx fetches the object from MinIO through a presigned URL and serves it itself,
+        Range requests and the stored content type included; Django sends no body bytes
+        """
+        url = urlsplit(presigned_media_url(path))
+        resp = HttpResponse()
+        resp['X-Accel-Redirect'] = f'{settings.MEDIA_ACCEL_LOCATION}{url.netloc}{url.path}?{url.query}'
+        # let nginx pass through the Content-Type returned by MinIO
+        del resp['Content-Type']
+        return resp
+
+    @staticmethod
+    def presigned_redirect(path, headers):
+        """
+        MinIO answers the presigned URL with the same ETag and Last-Modified and, through
+        response-cache-control, the same Cache-Control; the redirect itself carries no validators,
+        a revalidated redirect would keep pointing to a URL whose signature has expired
+        """
+        resp = HttpResponseRedirect(
+            presigned_media_url(path, public=True, ResponseCacheControl=headers['Cache-Control'])
+        )
+        # the redirect may be reused by the client while the signature is still valid
+        resp['Cache-Control'] = f'private, max-age={settings.MEDIA_PRESIGNED_URL_EXPIRES // 2}'
+        return resp
+
 
 class AppleJSAPIView(APIView):
     permission_classes = [AllowAny, ]